@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Tandas largas (/enviar, /preview) en segundo plano.
+# El handler vuelve enseguida —los editores pueden seguir publicando en BORRADOR— y un único
+# mensaje de estado se va editando con el avance hasta mostrar el resultado final.
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+from telegram.error import TelegramError
+
+from config import SOURCE_CHAT_ID
+from core_utils import send_text
+from outbox import limited
+from publisher import Progress
+from ratelimit import LIMITER
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 20.0   # segundos entre ediciones del mensaje de estado
+PROGRESS_RESERVE = 5.0  # no editar si al BORRADOR le quedan menos tokens: primero comandos y avisos
+
+RUNNING: Dict[str, asyncio.Task] = {}
+
+def is_running(key: str) -> bool:
+    task = RUNNING.get(key)
+    return task is not None and not task.done()
+
+async def _edit(bot, message_id: int, text: str):
+    try:
+        await limited(SOURCE_CHAT_ID, lambda: bot.edit_message_text(text, chat_id=SOURCE_CHAT_ID, message_id=message_id))
+    except TelegramError as e:
+        if "not modified" not in str(e).lower():
+            logger.warning(f"No pude actualizar el progreso → {e}")
+
+async def _report(bot, message_id: int, label: str, progress: Progress):
+    last = 0  # el mensaje ya nace con 0
+    while True:
+        await asyncio.sleep(PROGRESS_EVERY)
+        if progress.done != last and LIMITER.bucket(SOURCE_CHAT_ID).available() >= PROGRESS_RESERVE:
+            last = progress.done
+            await _edit(bot, message_id, f"{label}: {last}/{progress.total}…")
+
+async def _run(bot, key: str, label: str, progress: Progress,
+               work: Callable[[Progress], Awaitable[str]]):
+    status = reporter = None
+    try:
+        # sin mensaje de estado (red caída, RetryAfter) la tanda corre igual, sin avance visible
+        try:
+            status = await send_text(bot, f"{label}: 0/{progress.total}…", disable_notification=True)
+            reporter = asyncio.create_task(_report(bot, status.message_id, label, progress))
+        except Exception as e:
+            logger.warning(f"Sin mensaje de estado para '{key}' → {e}")
+        result = await work(progress)
+    except asyncio.CancelledError:
+        result = f"⏸️ {label} interrumpido ({progress.done}/{progress.total}); se reanuda con el mismo comando."
+        raise
+    except Exception as e:
+        logger.exception(f"Error en tarea de fondo '{key}': {e}")
+        result = f"❌ {label} falló (revisa logs)."
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        if status is not None:
+            await _edit(bot, status.message_id, result)
+        else:
+            try:
+                await send_text(bot, result)
+            except Exception as e:
+                logger.warning(f"No pude informar el resultado de '{key}' → {e}")
+        RUNNING.pop(key, None)
+
+def start(bot, key: str, label: str, total: int, work: Callable[[Progress], Awaitable[str]]) -> bool:
+    """
+    Lanza `work(progress)` en segundo plano; devuelve False si ya hay una tanda `key` en curso.
+    `work` devuelve el texto final que quedará en el mensaje de estado.
+    """
+    if is_running(key):
+        return False
+    RUNNING[key] = asyncio.create_task(_run(bot, key, label, Progress(total), work))
+    return True
+
+async def shutdown():
+    """
+    Cancela las tandas en curso; el diario de entregas permite reanudarlas luego.
+    Va en post_stop: el aviso de "interrumpido" necesita el bot aún abierto.
+    """
+    tasks = [t for t in RUNNING.values() if not t.done()]
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    RUNNING.clear()
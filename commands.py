@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Registro de comandos del BORRADOR.
+# Cada comando declara nombre, alias, parser de argumentos y textos de ayuda; de aquí salen
+# el despacho de handle_channel, el panel de /comandos y el menú de set_my_commands.
+# La búsqueda es un trie de prefijos: gana el nombre/alias registrado más largo que sea
+# prefijo del comando escrito (así /enviar_casos_clinicos sigue siendo /enviar).
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from core_utils import extract_id_from_text
+
+def parse_rest(arg: str) -> str:
+    return arg.strip()
+
+def parse_id(arg: str) -> Optional[int]:
+    """'123' o 'id:123' -> 123; None si no hay."""
+    return extract_id_from_text("/_ " + arg)
+
+class Command(NamedTuple):
+    name: str
+    handler: Callable[..., Awaitable[Any]]        # handler(update, context, valor_parseado)
+    aliases: Tuple[str, ...] = ()
+    parse: Callable[[str], Any] = parse_rest
+    usage: str = ""                               # argumentos tal como se muestran en la ayuda
+    help: Optional[str] = None                    # línea del panel /comandos (None = no sale)
+    menu: Optional[str] = None                    # descripción en set_my_commands (None = no sale)
+    exact: bool = False                           # solo coincide con el comando completo
+
+_END = ""  # clave de fin de palabra en los nodos del trie
+
+class CommandRegistry:
+    def __init__(self):
+        self._commands: List[Command] = []
+        self._trie: Dict[str, Any] = {}
+
+    def _insert(self, word: str, cmd: Command):
+        node = self._trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        if _END in node and node[_END] is not cmd:
+            raise ValueError(f"Comando duplicado: /{word}")
+        node[_END] = cmd
+
+    def add(self, cmd: Command) -> Command:
+        for word in (cmd.name, *cmd.aliases):
+            self._insert(word.lower(), cmd)
+        self._commands.append(cmd)
+        return cmd
+
+    def lookup(self, word: str) -> Optional[Command]:
+        """Comando cuyo nombre/alias es el prefijo más largo de `word` (sin '/')."""
+        word = word.lower()
+        node, best = self._trie, None
+        for i, ch in enumerate(word):
+            node = node.get(ch)
+            if node is None:
+                break
+            cmd = node.get(_END)
+            if cmd is not None and (not cmd.exact or i == len(word) - 1):
+                best = cmd
+        return best
+
+    def resolve(self, text: str) -> Tuple[Optional[Command], str]:
+        """'/programar 2025-01-01 08:00' -> (Command, '2025-01-01 08:00')."""
+        parts = (text or "").strip().split(maxsplit=1)
+        if not parts or not parts[0].startswith("/"):
+            return None, ""
+        word = parts[0][1:].split("@", 1)[0]  # /cmd@MiBot
+        return self.lookup(word), (parts[1] if len(parts) > 1 else "")
+
+    def help_lines(self) -> List[str]:
+        lines = []
+        for c in self._commands:
+            if not c.help:
+                continue
+            head = f"/{c.name}" + (f" {c.usage}" if c.usage else "")
+            alias = f" (alias: {', '.join('/' + a for a in c.aliases)})" if c.aliases else ""
+            lines.append(f"• {head} — {c.help}{alias}")
+        return lines
+
+    def bot_commands(self) -> List[Tuple[str, str]]:
+        return [(c.name, c.menu) for c in self._commands if c.menu]
+
+REGISTRY = CommandRegistry()
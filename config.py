@@ -18,8 +18,26 @@ PREVIEW_CHAT_ID = int(os.environ.get("PREVIEW_CHAT_ID", str(PREVIEW_FALLBACK)))
 
 DB_FILE = os.environ.get("DB_FILE", "drafts.db")
 
-# Pausa base entre envíos (seg) para no rozar el flood control
-PAUSE = float(os.environ.get("PAUSE", "0.6"))
+# Límites de envío (token buckets) para no rozar el flood control
+RATE_GLOBAL_PER_SEC = float(os.environ.get("RATE_GLOBAL_PER_SEC", "30"))  # por bot
+RATE_CHAT_PER_MIN = float(os.environ.get("RATE_CHAT_PER_MIN", "20"))      # por canal
+
+# Programaciones vencidas mientras el bot estaba apagado:
+#   run   -> se ejecutan al arrancar
+#   skip  -> se descartan (los borradores vuelven a la cola)
+#   grace -> se ejecutan si no llevan más de SCHEDULE_CATCHUP_GRACE_MIN minutos de retraso
+SCHEDULE_CATCHUP = os.environ.get("SCHEDULE_CATCHUP", "run").strip().lower()
+SCHEDULE_CATCHUP_GRACE_MIN = int(os.environ.get("SCHEDULE_CATCHUP_GRACE_MIN", "60"))
+
+# Updates atendidos a la vez (los channel_post del BORRADOR siempre van en orden)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "8"))
+
+# Modo webhook (opcional). Sin WEBHOOK_URL se usa polling, como siempre.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").strip()            # URL pública base (https://…)
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")        # interfaz del servidor local
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8443")))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "").strip() or None  # cabecera X-Telegram-Bot-Api-Secret-Token
 
 # Zona horaria (24h). Recomendado "America/Bogota".
 TZNAME = os.environ.get("TIMEZONE", "America/Bogota")
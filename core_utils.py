@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import heapq
 import re
+import time
 from datetime import datetime
-from typing import Optional, List, Tuple, Set
+import logging
+from typing import Dict, Iterable, Optional, List, Tuple, Set
+
+from telegram.error import TelegramError
 
 from config import TZ, SOURCE_CHAT_ID
+from outbox import limited
+
+logger = logging.getLogger(__name__)
+
+# delete_messages acepta hasta 100 ids por llamada
+DELETE_BATCH = 100
 
 # --------- helpers genéricos ---------
 async def safe_sleep(seconds: float):
@@ -13,19 +24,105 @@ async def safe_sleep(seconds: float):
     except Exception:
         pass
 
+async def send_text(bot, text: str, **kwargs):
+    """send_message al BORRADOR por el despachador de salida (prioridad de aviso salvo que se indique otra)."""
+    return await limited(SOURCE_CHAT_ID, lambda: bot.send_message(SOURCE_CHAT_ID, text, **kwargs))
+
+async def delete_messages_bulk(bot, chat_id: int, ids: Iterable[int]) -> Set[int]:
+    """Borra `ids` de `chat_id` con delete_messages en tandas de 100. Devuelve los que salieron bien."""
+    ids = sorted(set(ids))
+    done: Set[int] = set()
+    for i in range(0, len(ids), DELETE_BATCH):
+        chunk = ids[i:i + DELETE_BATCH]
+        try:
+            await limited(chat_id, lambda c=chunk: bot.delete_messages(chat_id, c))
+            done.update(chunk)
+        except TelegramError as e:
+            logger.warning(f"No pude borrar {len(chunk)} mensajes en {chat_id} → {e}")
+    return done
+
+async def edit_query(query, text: str, **kwargs):
+    """Edita el mensaje de un botón (menús) por el despachador de salida."""
+    chat_id = query.message.chat_id if query.message else SOURCE_CHAT_ID
+    return await limited(chat_id, lambda: query.edit_message_text(text, **kwargs))
+
+class NoticeManager:
+    """
+    Mensajes del bot que deben desaparecer (avisos temporales, comandos ya atendidos).
+    Las caducidades viven en un único heap con una sola tarea temporizadora: despierta
+    cuando vence el primero y borra juntos, con delete_messages, todos los que venzan
+    dentro de la ventana `COALESCE`.
+    """
+    COALESCE = 1.0  # segundos: agrupa en un solo borrado lo que vence casi a la vez
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int]] = []  # (vence_en_monotonic, chat_id, message_id)
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def expire(self, bot, chat_id: int, message_id: int, ttl: float):
+        """Programa el borrado de `message_id` dentro de `ttl` segundos."""
+        self._bot = bot
+        due = time.monotonic() + max(0.0, ttl)
+        first = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due, chat_id, message_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        elif first is None or due < first:
+            self._wake.set()  # hay uno nuevo que vence antes: recalcular la espera
+
+    def _pop_due(self, horizon: float) -> Dict[int, List[int]]:
+        due: Dict[int, List[int]] = {}
+        while self._heap and self._heap[0][0] <= horizon:
+            _, chat_id, mid = heapq.heappop(self._heap)
+            due.setdefault(chat_id, []).append(mid)
+        return due
+
+    async def _delete(self, due: Dict[int, List[int]]):
+        for chat_id, ids in due.items():
+            await delete_messages_bulk(self._bot, chat_id, ids)
+
+    async def _run(self):
+        while self._heap:
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                    continue  # llegó uno que vence antes
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._delete(self._pop_due(time.monotonic() + self.COALESCE))
+            except Exception as e:
+                logger.warning(f"No pude borrar avisos vencidos → {e}")
+
+    async def shutdown(self):
+        """Para el temporizador y borra ya lo pendiente (que no quede basura en el canal)."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._heap and self._bot is not None:
+            try:
+                await self._delete(self._pop_due(float("inf")))
+            except Exception as e:
+                logger.warning(f"No pude borrar avisos al apagar → {e}")
+        self._heap.clear()
+
+NOTICES = NoticeManager()
+
 async def temp_notice(bot, text: str, ttl: int = 6):
-    """Envía un aviso temporal y lo borra pasado `ttl` segundos."""
+    """Envía un aviso temporal; NOTICES lo borra pasado `ttl` segundos."""
     try:
-        m = await bot.send_message(SOURCE_CHAT_ID, text, disable_notification=True)
+        m = await send_text(bot, text, disable_notification=True)
     except Exception:
         return
-    async def _auto_del():
-        await safe_sleep(ttl)
-        try:
-            await bot.delete_message(SOURCE_CHAT_ID, m.message_id)
-        except Exception:
-            pass
-    asyncio.create_task(_auto_del())
+    NOTICES.expire(bot, SOURCE_CHAT_ID, m.message_id, ttl)
 
 def human_eta(target_dt: datetime, now: Optional[datetime] = None) -> str:
     """Texto corto tipo 'en 27 min' / 'en 1 h 15 m' / 'en 2 d 3 h'."""
@@ -42,6 +139,17 @@ def human_eta(target_dt: datetime, now: Optional[datetime] = None) -> str:
     hours = hours % 24
     return f"en {days} d {hours} h" if hours else f"en {days} d"
 
+def human_duration(seconds: float) -> str:
+    """Duración corta tipo '≈ 40 s' / '≈ 8 min' / '≈ 1 h 5 m'."""
+    sec = max(0, int(round(seconds)))
+    if sec < 60:
+        return f"≈ {sec} s"
+    mins = (sec + 30) // 60
+    if mins < 60:
+        return f"≈ {mins} min"
+    hours, mins = divmod(mins, 60)
+    return f"≈ {hours} h {mins} m" if mins else f"≈ {hours} h"
+
 def extract_id_from_text(txt: str) -> Optional[int]:
     """Extrae un ID desde '/cmd <id>' o '/cmd id:<id>'."""
     parts = (txt or "").split()
@@ -61,9 +169,10 @@ def deep_link_for_channel_message(chat_id: int, mid: int) -> str:
         cid = cid[4:]
     return f"https://t.me/c/{cid}/{mid}"
 
-def parse_nuke_selection(arg: str, drafts: List[Tuple[int, str]]) -> Set[int]:
+def parse_nuke_selection(arg: str, drafts: List[Tuple[int, str, List[int]]]) -> Set[int]:
     """
     Convierte una selección textual basada en posiciones de /listar a IDs de mensajes.
+    Cada entrada es (id, snippet, ids): un álbum ocupa una sola posición y se selecciona entero.
     Soporta:
       - 'all' / 'todos' → todos
       - '1,3,5' o '1, 3, 5' → lista de posiciones
@@ -71,20 +180,22 @@ def parse_nuke_selection(arg: str, drafts: List[Tuple[int, str]]) -> Set[int]:
       - número simple 'N' → 'últimos N'
     """
     arg = (arg or "").strip().lower()
-    ids_in_order = [did for (did, _snip) in drafts]
+    ids_in_order = [ids for (_did, _snip, ids) in drafts]
     result: Set[int] = set()
 
     if not arg:
         return result
 
     if arg in ("all", "todos"):
-        result.update(ids_in_order)
+        for ids in ids_in_order:
+            result.update(ids)
         return result
 
     if arg.isdigit():
         n = int(arg)
         if n > 0:
-            result.update(ids_in_order[-n:])
+            for ids in ids_in_order[-n:]:
+                result.update(ids)
         return result
 
     # Acepta "1,2,3" o "1, 2, 3"
@@ -101,10 +212,10 @@ def parse_nuke_selection(arg: str, drafts: List[Tuple[int, str]]) -> Set[int]:
             for pos in range(lo, hi + 1):
                 idx = pos - 1
                 if 0 <= idx < len(ids_in_order):
-                    result.add(ids_in_order[idx])
+                    result.update(ids_in_order[idx])
         elif p.isdigit():
             pos = int(p)
             idx = pos - 1
             if 0 <= idx < len(ids_in_order):
-                result.add(ids_in_order[idx])
+                result.update(ids_in_order[idx])
     return result
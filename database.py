@@ -1,21 +1,111 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
+import json
+import logging
 import sqlite3
-from typing import List, Tuple, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from send_plan import build_send_plan, encode_plan, decode_plan
+from pending_index import PendingIndex
+
+logger = logging.getLogger(__name__)
 
 _schema = """
 CREATE TABLE IF NOT EXISTS drafts (
   message_id INTEGER PRIMARY KEY,
   snippet    TEXT,
-  raw_json   TEXT,
+  raw_json   BLOB,   -- mensaje crudo compactado + zlib (filas antiguas: JSON en texto)
+  media_group_id TEXT,
+  plan       TEXT,
+  schedule_id INTEGER,  -- reservado por una programación (NULL = libre)
   sent       INTEGER NOT NULL DEFAULT 0,
   deleted    INTEGER NOT NULL DEFAULT 0,
+  version    INTEGER NOT NULL DEFAULT 0,  -- sube con cada edición en BORRADOR
+  updated_at INTEGER,
   created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
 );
 CREATE INDEX IF NOT EXISTS idx_drafts_sent_deleted ON drafts(sent, deleted);
+
+-- Diario de entregas: una fila por (borrador, target) publicado con éxito.
+-- Es también el mapa de lo publicado (borrador -> mensaje en el target) que usa /retirar.
+CREATE TABLE IF NOT EXISTS deliveries (
+  draft_id          INTEGER NOT NULL,
+  target_chat_id    INTEGER NOT NULL,
+  posted_message_id INTEGER,
+  run_id            INTEGER,                 -- tanda (publish_runs.id) en la que salió
+  created_at        INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+  PRIMARY KEY (draft_id, target_chat_id)
+);
+
+-- Tandas de publicación (/enviar, una programación, un goteo entero)
+CREATE TABLE IF NOT EXISTS publish_runs (
+  id           INTEGER PRIMARY KEY AUTOINCREMENT,
+  schedule_id  INTEGER,                      -- NULL = /enviar manual
+  created_at   INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+  retracted_at INTEGER                       -- /retirar
+);
+
+-- Lo que hay ahora en PREVIEW: qué versión de cada borrador se mandó y como qué mensaje.
+-- /preview solo reenvía lo nuevo o editado (drafts.version distinta) y borra la copia vieja.
+CREATE TABLE IF NOT EXISTS preview_copies (
+  draft_id           INTEGER PRIMARY KEY,
+  preview_message_id INTEGER,                -- NULL si copy_messages no dio el mapeo
+  version            INTEGER NOT NULL,
+  created_at         INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+-- Programaciones (/programar): sobreviven a reinicios. Los IDs van en drafts.schedule_id.
+CREATE TABLE IF NOT EXISTS schedules (
+  id         INTEGER PRIMARY KEY AUTOINCREMENT,
+  when_ts    INTEGER NOT NULL,
+  status     TEXT NOT NULL DEFAULT 'pending',  -- pending | running | done | failed | cancelled | skipped
+  total      INTEGER NOT NULL DEFAULT 0,
+  kind       TEXT NOT NULL DEFAULT 'once',     -- once | drip
+  start_ts   INTEGER,                          -- goteo: ventana [start_ts, end_ts]
+  end_ts     INTEGER,
+  curve      TEXT,
+  done       INTEGER NOT NULL DEFAULT 0,       -- goteo: envíos ya hechos (de `total`)
+  deadline_ts INTEGER,                         -- hora pedida por el usuario (when_ts puede adelantarse)
+  align      TEXT,                             -- inicio | llegar | centrar
+  created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+CREATE INDEX IF NOT EXISTS idx_schedules_status_when ON schedules(status, when_ts);
+
 """
 
+# Velocidad medida por target: media móvil exponencial de segundos por LLAMADA a la API
+# (una encuesta, un álbum o un lote de copy_messages), no por borrador: un lote de 100
+# cuesta lo mismo que una encuesta, así que por borrador la media bailaría con la mezcla.
+_THROUGHPUT_DDL = """
+CREATE TABLE IF NOT EXISTS throughput (
+  target_chat_id INTEGER PRIMARY KEY,
+  sec_per_unit   REAL NOT NULL,
+  samples        INTEGER NOT NULL DEFAULT 1,
+  updated_at     INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+"""
+_schema += _THROUGHPUT_DDL
+
 _conn_cache = {}
 
+# Todo el SQLite corre en UN hilo dedicado: el event loop nunca espera a un commit
+# y las operaciones quedan serializadas en el orden en que se piden.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+def _on_db_thread(fn):
+    """Convierte una operación síncrona en corrutina que se ejecuta en el hilo de SQLite."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        # Cualquier operación ve antes los borradores que aún esperan en el write-behind
+        if args and _save_buffer.get(args[0]):
+            await flush_drafts(args[0])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_DB_EXECUTOR, functools.partial(fn, *args, **kwargs))
+    return wrapper
+
 def _conn(path: str) -> sqlite3.Connection:
     conn = _conn_cache.get(path)
     if conn:
@@ -26,51 +116,618 @@ def _conn(path: str) -> sqlite3.Connection:
     _conn_cache[path] = conn
     return conn
 
+# ========= raw_json compacto =========
+# Campos de Message.to_dict() que nunca leemos (el chat es siempre el BORRADOR)
+_RAW_DROP = ("chat", "sender_chat", "from", "author_signature")
+
+def encode_raw(raw: dict) -> bytes:
+    """Mensaje crudo → JSON compacto sin los campos redundantes → zlib."""
+    slim = {k: v for k, v in (raw or {}).items() if k not in _RAW_DROP}
+    return zlib.compress(json.dumps(slim, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decode_raw(value) -> dict:
+    """Inverso de encode_raw; acepta también el formato antiguo (JSON en texto)."""
+    if not value:
+        return {}
+    try:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = zlib.decompress(bytes(value)).decode("utf-8")
+        return json.loads(value)
+    except Exception:
+        return {}
+
+def _columns(c: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _migrate(c: sqlite3.Connection):
+    """Añade columnas nuevas a bases creadas con versiones anteriores."""
+    cols = _columns(c, "drafts")
+    if "media_group_id" not in cols:
+        c.execute("ALTER TABLE drafts ADD COLUMN media_group_id TEXT")
+        c.execute(
+            "UPDATE drafts SET media_group_id = json_extract(raw_json, '$.media_group_id') "
+            "WHERE raw_json LIKE '%media_group_id%' AND json_valid(raw_json)"
+        )
+    if "plan" not in cols:
+        c.execute("ALTER TABLE drafts ADD COLUMN plan TEXT")
+    if "schedule_id" not in cols:
+        c.execute("ALTER TABLE drafts ADD COLUMN schedule_id INTEGER")
+    if "version" not in cols:
+        c.execute("ALTER TABLE drafts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    if "updated_at" not in cols:
+        c.execute("ALTER TABLE drafts ADD COLUMN updated_at INTEGER")
+    if "sec_per_unit" not in _columns(c, "throughput"):
+        # antes se medía por borrador: no es convertible, se vuelve a medir desde cero
+        c.execute("DROP TABLE throughput")
+        c.executescript(_THROUGHPUT_DDL)
+    if "run_id" not in _columns(c, "deliveries"):
+        c.execute("ALTER TABLE deliveries ADD COLUMN run_id INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_run ON deliveries(run_id)")
+    scols = _columns(c, "schedules")
+    for col, decl in (
+        ("kind", "TEXT NOT NULL DEFAULT 'once'"),
+        ("start_ts", "INTEGER"),
+        ("end_ts", "INTEGER"),
+        ("curve", "TEXT"),
+        ("done", "INTEGER NOT NULL DEFAULT 0"),
+        ("deadline_ts", "INTEGER"),
+        ("align", "TEXT"),
+    ):
+        if col not in scols:
+            c.execute(f"ALTER TABLE schedules ADD COLUMN {col} {decl}")
+    # "pendientes sin programar" y "pendientes de la programación N" salen directos del índice
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_drafts_pending_sched "
+        "ON drafts(sent, deleted, schedule_id, message_id)"
+    )
+    _backfill_plans(c)
+
+def _backfill_plans(c: sqlite3.Connection):
+    """Calcula el plan de envío de los pendientes guardados antes de existir la columna."""
+    rows = c.execute("SELECT message_id, raw_json FROM drafts WHERE plan IS NULL AND sent=0").fetchall()
+    updates = []
+    for mid, raw in rows:
+        data = decode_raw(raw)
+        updates.append((encode_plan(build_send_plan(data)), mid))
+    if updates:
+        c.executemany("UPDATE drafts SET plan=? WHERE message_id=?", updates)
+
+def _compress_legacy_raw(c: sqlite3.Connection) -> int:
+    """Reescribe en sitio los raw_json guardados como texto al formato compacto. Devuelve cuántos."""
+    total = 0
+    while True:
+        rows = c.execute(
+            "SELECT message_id, raw_json FROM drafts WHERE typeof(raw_json)='text' LIMIT 500"
+        ).fetchall()
+        if not rows:
+            return total
+        c.executemany(
+            "UPDATE drafts SET raw_json=? WHERE message_id=?",
+            [(encode_raw(decode_raw(raw)), mid) for (mid, raw) in rows]
+        )
+        c.commit()
+        total += len(rows)
+
 def init_db(path: str):
     c = _conn(path)
     c.executescript(_schema)
+    _migrate(c)
     c.commit()
+    if _compress_legacy_raw(c):
+        # devolver al disco el espacio que ocupaban los JSON en texto
+        c.execute("VACUUM")
+        c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    _load_index(path)
+
+# ========= índice en memoria de la cola =========
+_indexes: Dict[str, PendingIndex] = {}
+
+def _load_index(path: str):
+    idx = _indexes.setdefault(path, PendingIndex())
+    idx.load(_conn(path).execute(
+        "SELECT message_id, COALESCE(snippet,''), media_group_id, schedule_id "
+        "FROM drafts WHERE sent=0 AND deleted=0"
+    ).fetchall())
+
+def pending_index(path: str) -> PendingIndex:
+    return _indexes.setdefault(path, PendingIndex())
+
+def pending_count(path: str) -> int:
+    return len(pending_index(path))
+
+def list_draft_groups(path: str, unscheduled: bool = False) -> List[Tuple[int, str, List[int]]]:
+    """
+    Pendientes agrupados por álbum [(primer_id, snippet, ids)], desde el índice en memoria.
+    Con `unscheduled`, solo los que no reservó ninguna programación (lo que muestra /listar).
+    """
+    return pending_index(path).entries(unscheduled)
+
+# ========= write-behind de borradores =========
+# Durante una ráfaga de publicaciones en BORRADOR los INSERT se acumulan y se escriben
+# juntos: por tamaño (SAVE_BATCH), por tiempo (SAVE_DELAY) o antes de cualquier otra
+# operación sobre la base (listar, enviar, cancelar…). close_db() vacía lo pendiente.
+SAVE_BATCH = 50
+SAVE_DELAY = 1.0
+FLUSH_RETRY = 5.0  # segundos hasta reintentar un volcado que falló
 
-def save_draft(path: str, message_id: int, snippet: str, raw_json: str):
+_save_buffer: Dict[str, List[tuple]] = {}
+_save_timers: Dict[str, asyncio.TimerHandle] = {}
+_flush_tasks: Set[asyncio.Task] = set()
+
+def _insert_drafts(path: str, rows: List[tuple]):
     c = _conn(path)
-    c.execute(
-        "INSERT OR IGNORE INTO drafts(message_id, snippet, raw_json) VALUES (?,?,?)",
-        (message_id, snippet or "", raw_json or "")
+    c.executemany(
+        "INSERT OR IGNORE INTO drafts(message_id, snippet, raw_json, media_group_id, plan) VALUES (?,?,?,?,?)",
+        [(mid, snip, encode_raw(raw), group, plan) for (mid, snip, raw, group, plan) in rows]
+    )
+    c.commit()
+
+async def flush_drafts(path: str):
+    """Escribe en una sola transacción los borradores acumulados para `path`."""
+    timer = _save_timers.pop(path, None)
+    if timer:
+        timer.cancel()
+    rows = _save_buffer.pop(path, None)
+    if not rows:
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(_DB_EXECUTOR, functools.partial(_insert_drafts, path, rows))
+    except Exception as e:
+        # no se pierden: vuelven al buffer (delante de lo llegado mientras tanto) y se reintenta
+        _save_buffer[path] = rows + _save_buffer.get(path, [])
+        if path not in _save_timers:
+            _save_timers[path] = loop.call_later(FLUSH_RETRY, _flush_later, path)
+        logger.error(f"No pude guardar {len(rows)} borradores; reintento en {FLUSH_RETRY:g}s → {e}")
+        raise
+
+async def _flush_quietly(path: str):
+    try:
+        await flush_drafts(path)
+    except Exception:
+        pass  # ya quedó en el log y las filas siguen en el buffer
+
+def _flush_later(path: str):
+    task = asyncio.ensure_future(_flush_quietly(path))
+    _flush_tasks.add(task)
+    task.add_done_callback(_flush_tasks.discard)
+
+async def save_draft(path: str, message_id: int, snippet: str, raw: dict,
+                     media_group_id: Optional[str] = None, plan: Optional[str] = None):
+    buf = _save_buffer.setdefault(path, [])
+    buf.append((message_id, snippet or "", raw, media_group_id, plan))
+    pending_index(path).add(message_id, snippet or "", media_group_id)
+    if len(buf) >= SAVE_BATCH:
+        await flush_drafts(path)
+    elif path not in _save_timers:
+        _save_timers[path] = asyncio.get_running_loop().call_later(SAVE_DELAY, _flush_later, path)
+
+class Draft(NamedTuple):
+    """Borrador tal como lo consume el publicador: su plan de envío, nunca el raw_json."""
+    message_id: int
+    snippet: str
+    media_group_id: Optional[str]
+    plan_json: Optional[str]
+
+    @property
+    def plan(self) -> dict:
+        return decode_plan(self.plan_json)
+
+# Tamaño de página de iter_unsent_drafts (filas por consulta)
+DRAFT_CHUNK = 200
+
+@_on_db_thread
+def _fetch_unsent_chunk(path: str, after: int, ids: Optional[str], schedule_id: Optional[int],
+                        include_deleted: bool, chunk_size: int) -> List[Draft]:
+    where = ["sent=0"] if include_deleted else ["sent=0", "deleted=0"]
+    params: List = []
+    if schedule_id is not None:
+        where.append("schedule_id = ?")
+        params.append(int(schedule_id))
+    where.append("message_id > ?")
+    params.append(after)
+    if ids is not None:
+        where.append("message_id IN (SELECT value FROM json_each(?))")
+        params.append(ids)
+    sql = (
+        "SELECT message_id, COALESCE(snippet,''), media_group_id, plan "
+        "FROM drafts WHERE " + " AND ".join(where) + " ORDER BY message_id ASC LIMIT ?"
+    )
+    params.append(chunk_size)
+    return [Draft(*row) for row in _conn(path).execute(sql, params).fetchall()]
+
+async def iter_unsent_drafts(path: str, *, ids: Optional[Iterable[int]] = None,
+                             schedule_id: Optional[int] = None,
+                             include_deleted: bool = False,
+                             chunk_size: int = DRAFT_CHUNK) -> AsyncIterator[Draft]:
+    """
+    Recorre los pendientes en orden de message_id, de `chunk_size` en `chunk_size`
+    (paginación por clave, sin cursores abiertos entre páginas).
+      - ids: solo esos IDs · schedule_id: solo los de esa programación
+      - include_deleted: no descarta los cancelados a mitad de tanda (conjunto fijo)
+    Solo se lee el plan de envío precalculado (columna `plan`), nunca el raw_json.
+    """
+    ids_json = json.dumps(list(ids)) if ids is not None else None
+    after = 0
+    while True:
+        chunk = await _fetch_unsent_chunk(path, after, ids_json, schedule_id, include_deleted, chunk_size)
+        for d in chunk:
+            yield d
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1].message_id
+
+@_on_db_thread
+def _mark_sent(path: str, ids: List[int]):
+    c = _conn(path)
+    q = "UPDATE drafts SET sent=1 WHERE message_id IN (%s)" % ",".join("?" * len(ids))
+    c.execute(q, ids)
+    c.commit()
+
+async def mark_sent(path: str, ids: List[int]):
+    if not ids:
+        return
+    await _mark_sent(path, ids)
+    pending_index(path).discard(ids)
+
+@_on_db_thread
+def record_deliveries(path: str, rows: List[Tuple[int, int, Optional[int], Optional[int]]]):
+    """Guarda en UNA transacción varias entregas (draft_id, target_chat_id, posted_message_id, run_id)."""
+    if not rows:
+        return
+    c = _conn(path)
+    c.executemany(
+        "INSERT OR REPLACE INTO deliveries(draft_id, target_chat_id, posted_message_id, run_id) VALUES (?,?,?,?)",
+        rows
+    )
+    c.commit()
+
+# ========= tandas publicadas (/retirar) =========
+@_on_db_thread
+def start_publish_run(path: str, schedule_id: Optional[int] = None) -> int:
+    """Abre una tanda. Una programación (o goteo) reutiliza la suya: sus pasos forman UNA tanda."""
+    c = _conn(path)
+    if schedule_id is not None:
+        row = c.execute("SELECT id FROM publish_runs WHERE schedule_id=? ORDER BY id DESC LIMIT 1",
+                        (schedule_id,)).fetchone()
+        if row:
+            return int(row[0])
+    cur = c.execute("INSERT INTO publish_runs(schedule_id) VALUES (?)", (schedule_id,))
+    c.commit()
+    return int(cur.lastrowid)
+
+@_on_db_thread
+def list_publish_runs(path: str, limit: int = 5) -> List[Tuple[int, Optional[int], int, Optional[int], int]]:
+    """Últimas tandas con algo publicado: [(run_id, schedule_id, created_at, retracted_at, mensajes)]."""
+    return _conn(path).execute(
+        "SELECT r.id, r.schedule_id, r.created_at, r.retracted_at, COUNT(d.draft_id) "
+        "FROM publish_runs r JOIN deliveries d ON d.run_id = r.id "
+        "GROUP BY r.id ORDER BY r.id DESC LIMIT ?",
+        (limit,)
+    ).fetchall()
+
+@_on_db_thread
+def get_run_messages(path: str, run_id: int) -> Dict[int, List[int]]:
+    """{target_chat_id: [mensajes publicados]} de una tanda."""
+    out: Dict[int, List[int]] = {}
+    for target, posted in _conn(path).execute(
+        "SELECT target_chat_id, posted_message_id FROM deliveries "
+        "WHERE run_id=? AND posted_message_id IS NOT NULL ORDER BY target_chat_id, posted_message_id",
+        (run_id,)
+    ):
+        out.setdefault(int(target), []).append(int(posted))
+    return out
+
+@_on_db_thread
+def mark_run_retracted(path: str, run_id: int):
+    c = _conn(path)
+    c.execute("UPDATE publish_runs SET retracted_at=strftime('%s','now') WHERE id=?", (run_id,))
+    c.commit()
+
+@_on_db_thread
+def get_delivered_pending(path: str, target_chat_id: int) -> Set[int]:
+    """Borradores aún no marcados como enviados que ya constan entregados en ese target."""
+    c = _conn(path)
+    cur = c.execute(
+        "SELECT d.draft_id FROM deliveries d JOIN drafts r ON r.message_id = d.draft_id "
+        "WHERE d.target_chat_id=? AND r.sent=0",
+        (target_chat_id,)
     )
+    return {int(r[0]) for r in cur.fetchall()}
+
+@_on_db_thread
+def _mark_deleted(path: str, message_id: int):
+    c = _conn(path)
+    # cancelar también lo saca de cualquier programación
+    c.execute("UPDATE drafts SET deleted=1, schedule_id=NULL WHERE message_id=?", (message_id,))
     c.commit()
 
-def get_unsent_drafts(path: str) -> List[Tuple[int, str, str]]:
+async def mark_deleted(path: str, message_id: int):
+    await _mark_deleted(path, message_id)
+    pending_index(path).discard([message_id])
+
+@_on_db_thread
+def _delete_drafts(path: str, ids: List[int]) -> int:
     c = _conn(path)
     cur = c.execute(
-        "SELECT message_id, snippet, raw_json FROM drafts WHERE sent=0 AND deleted=0 ORDER BY message_id ASC"
+        "DELETE FROM drafts WHERE message_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ids),)
     )
-    return list(cur.fetchall())
+    c.commit()
+    return cur.rowcount
 
-def mark_sent(path: str, ids: List[int]):
+async def delete_drafts(path: str, ids: Iterable[int]) -> int:
+    """Borra definitivamente esos borradores en UNA transacción. Devuelve cuántos había."""
+    ids = list(ids)
     if not ids:
+        return 0
+    n = await _delete_drafts(path, ids)
+    pending_index(path).discard(ids)
+    return n
+
+@_on_db_thread
+def _restore_draft(path: str, message_id: int) -> Optional[Tuple[str, Optional[str]]]:
+    c = _conn(path)
+    c.execute("UPDATE drafts SET deleted=0 WHERE message_id=?", (message_id,))
+    c.commit()
+    return c.execute(
+        "SELECT COALESCE(snippet,''), media_group_id FROM drafts WHERE message_id=? AND sent=0",
+        (message_id,)
+    ).fetchone()
+
+async def restore_draft(path: str, message_id: int):
+    row = await _restore_draft(path, message_id)
+    if row:
+        pending_index(path).add(message_id, row[0], row[1])
+
+# ========= ediciones =========
+@_on_db_thread
+def _update_draft(path: str, message_id: int, snippet: str, raw: dict,
+                  media_group_id: Optional[str], plan: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    c = _conn(path)
+    cur = c.execute(
+        "UPDATE drafts SET snippet=?, raw_json=?, media_group_id=?, plan=?, "
+        "  version=version+1, updated_at=strftime('%s','now') WHERE message_id=?",
+        (snippet, encode_raw(raw), media_group_id, plan, message_id)
+    )
+    c.commit()
+    if not cur.rowcount:
+        return None
+    row = c.execute("SELECT version, sent, deleted FROM drafts WHERE message_id=?", (message_id,)).fetchone()
+    return int(row[0]), int(row[1]), int(row[2])
+
+async def update_draft(path: str, message_id: int, snippet: str, raw: dict,
+                       media_group_id: Optional[str] = None, plan: Optional[str] = None) -> Optional[int]:
+    """Reescribe un borrador editado en BORRADOR. Devuelve la nueva versión (None si no existe)."""
+    res = await _update_draft(path, message_id, snippet, raw, media_group_id, plan)
+    if res is None:
+        return None
+    version, sent, deleted = res
+    if not sent and not deleted:
+        pending_index(path).update(message_id, snippet)
+    return version
+
+@_on_db_thread
+def get_deliveries(path: str, draft_id: int) -> List[Tuple[int, int]]:
+    """Copias publicadas (y no retiradas con /retirar) de un borrador: [(target_chat_id, posted_message_id)]."""
+    return [(int(t), int(p)) for (t, p) in _conn(path).execute(
+        "SELECT d.target_chat_id, d.posted_message_id FROM deliveries d "
+        "LEFT JOIN publish_runs r ON r.id = d.run_id "
+        "WHERE d.draft_id=? AND d.posted_message_id IS NOT NULL AND r.retracted_at IS NULL",
+        (draft_id,)
+    )]
+
+# ========= copias en PREVIEW =========
+@_on_db_thread
+def preview_state(path: str) -> List[Tuple[int, int, Optional[int], Optional[int]]]:
+    """Pendientes libres y su copia en PREVIEW: [(draft_id, version, version_en_preview, preview_message_id)]."""
+    return _conn(path).execute(
+        "SELECT d.message_id, d.version, p.version, p.preview_message_id "
+        "FROM drafts d LEFT JOIN preview_copies p ON p.draft_id = d.message_id "
+        "WHERE d.sent=0 AND d.deleted=0 AND d.schedule_id IS NULL ORDER BY d.message_id"
+    ).fetchall()
+
+@_on_db_thread
+def record_preview_copies(path: str, rows: List[Tuple[int, Optional[int], int]]):
+    """Anota en UNA transacción (draft_id, preview_message_id, version) de lo mandado a PREVIEW."""
+    if not rows:
         return
     c = _conn(path)
-    q = "UPDATE drafts SET sent=1 WHERE message_id IN (%s)" % ",".join("?" * len(ids))
-    c.execute(q, ids)
+    c.executemany(
+        "INSERT OR REPLACE INTO preview_copies(draft_id, preview_message_id, version) VALUES (?,?,?)",
+        rows
+    )
     c.commit()
 
-def list_drafts(path: str) -> List[Tuple[int, str]]:
+@_on_db_thread
+def list_preview_copies(path: str) -> List[int]:
+    """Todos los mensajes que constan en PREVIEW (para /preview reset)."""
+    return [int(r[0]) for r in _conn(path).execute(
+        "SELECT preview_message_id FROM preview_copies WHERE preview_message_id IS NOT NULL "
+        "ORDER BY preview_message_id"
+    )]
+
+@_on_db_thread
+def clear_preview_copies(path: str):
     c = _conn(path)
+    c.execute("DELETE FROM preview_copies")
+    c.commit()
+
+# ========= reservas de programación =========
+@_on_db_thread
+def _reserve_drafts(path: str, ids: List[int], schedule_id: int) -> List[int]:
+    c = _conn(path)
+    c.execute(
+        "UPDATE drafts SET schedule_id=? WHERE sent=0 AND deleted=0 AND schedule_id IS NULL "
+        "AND message_id IN (SELECT value FROM json_each(?))",
+        (schedule_id, json.dumps(ids))
+    )
+    c.commit()
+    return [int(r[0]) for r in c.execute(
+        "SELECT message_id FROM drafts WHERE sent=0 AND deleted=0 AND schedule_id=? ORDER BY message_id",
+        (schedule_id,)
+    ).fetchall()]
+
+async def reserve_drafts(path: str, ids: Iterable[int], schedule_id: int) -> List[int]:
+    """
+    Reserva para `schedule_id` los de `ids` que sigan libres. Devuelve los reservados.
+    Lo que está saliendo en una publicación en curso no se reserva (saldría dos veces).
+    """
+    idx = pending_index(path)
+    ids = [mid for mid in ids if not idx.is_busy(mid)]
+    if not ids:
+        return []
+    got = await _reserve_drafts(path, ids, schedule_id)
+    pending_index(path).reserve(got, schedule_id)
+    return got
+
+@_on_db_thread
+def _release_schedule(path: str, schedule_id: Optional[int]) -> List[int]:
+    c = _conn(path)
+    if schedule_id is None:
+        cond, params = "schedule_id IS NOT NULL", ()
+    else:
+        cond, params = "schedule_id=?", (schedule_id,)
+    ids = [int(r[0]) for r in c.execute(
+        f"SELECT message_id FROM drafts WHERE sent=0 AND {cond}", params
+    ).fetchall()]
+    c.execute(f"UPDATE drafts SET schedule_id=NULL WHERE sent=0 AND {cond}", params)
+    c.commit()
+    return ids
+
+async def release_schedule(path: str, schedule_id: Optional[int]) -> List[int]:
+    """Libera lo que siga reservado por `schedule_id` (None = todas). Devuelve los liberados."""
+    ids = await _release_schedule(path, schedule_id)
+    pending_index(path).release(ids)
+    return ids
+
+# ========= programaciones =========
+_ACTIVE = "('pending','running')"
+
+class Schedule(NamedTuple):
+    id: int
+    when_ts: int          # próxima ejecución (en goteo avanza con cada envío)
+    status: str
+    total: int            # mensajes (once) o envíos (drip) reservados
+    remaining: int        # borradores reservados aún sin enviar
+    kind: str
+    start_ts: Optional[int]
+    end_ts: Optional[int]
+    curve: Optional[str]
+    done: int
+    deadline_ts: Optional[int]
+    align: Optional[str]
+
+_SCHEDULE_SELECT = (
+    "SELECT s.id, s.when_ts, s.status, s.total, COUNT(d.message_id), "
+    "       s.kind, s.start_ts, s.end_ts, s.curve, s.done, s.deadline_ts, s.align "
+    "FROM schedules s LEFT JOIN drafts d "
+    "  ON d.schedule_id = s.id AND d.sent=0 AND d.deleted=0 "
+)
+
+@_on_db_thread
+def create_schedule(path: str, when_ts: int, *, kind: str = "once",
+                    end_ts: Optional[int] = None, curve: Optional[str] = None,
+                    deadline_ts: Optional[int] = None, align: Optional[str] = None) -> int:
+    c = _conn(path)
+    # no pisar reservas que sobrevivieron sin fila en `schedules` (bases anteriores)
+    row = c.execute("SELECT MAX(schedule_id) FROM drafts").fetchone()
+    floor = int(row[0] or 0)
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name='schedules'").fetchone()
+    if floor and (not seq or seq[0] < floor):
+        c.execute("INSERT OR REPLACE INTO sqlite_sequence(name, seq) VALUES ('schedules', ?)", (floor,))
+    start_ts = int(when_ts) if kind == "drip" else None
     cur = c.execute(
-        "SELECT message_id, COALESCE(snippet,'') FROM drafts WHERE sent=0 AND deleted=0 ORDER BY message_id ASC"
+        "INSERT INTO schedules(when_ts, kind, start_ts, end_ts, curve, deadline_ts, align) "
+        "VALUES (?,?,?,?,?,?,?)",
+        (int(when_ts), kind, start_ts, end_ts, curve, deadline_ts, align),
     )
-    return list(cur.fetchall())
+    c.commit()
+    return int(cur.lastrowid)
 
-def mark_deleted(path: str, message_id: int):
+@_on_db_thread
+def update_schedule(path: str, schedule_id: int, *, status: Optional[str] = None,
+                    total: Optional[int] = None, when_ts: Optional[int] = None,
+                    done: Optional[int] = None, start_ts: Optional[int] = None,
+                    end_ts: Optional[int] = None):
+    sets, params = [], []
+    for col, val in (("status", status), ("total", total), ("when_ts", when_ts), ("done", done),
+                     ("start_ts", start_ts), ("end_ts", end_ts)):
+        if val is not None:
+            sets.append(f"{col}=?")
+            params.append(val)
+    if not sets:
+        return
     c = _conn(path)
-    c.execute("UPDATE drafts SET deleted=1 WHERE message_id=?", (message_id,))
+    c.execute(f"UPDATE schedules SET {', '.join(sets)} WHERE id=?", (*params, schedule_id))
     c.commit()
 
-def restore_draft(path: str, message_id: int):
+@_on_db_thread
+def active_schedules(path: str) -> List[Schedule]:
+    """Programaciones vivas en UNA consulta, ordenadas por próxima ejecución."""
+    rows = _conn(path).execute(
+        _SCHEDULE_SELECT + f"WHERE s.status IN {_ACTIVE} GROUP BY s.id ORDER BY s.when_ts, s.id"
+    ).fetchall()
+    return [Schedule(*r) for r in rows]
+
+@_on_db_thread
+def due_schedules(path: str, now_ts: int) -> List[Schedule]:
+    rows = _conn(path).execute(
+        _SCHEDULE_SELECT + "WHERE s.status='pending' AND s.when_ts <= ? GROUP BY s.id ORDER BY s.when_ts, s.id",
+        (int(now_ts),)
+    ).fetchall()
+    return [Schedule(*r) for r in rows]
+
+@_on_db_thread
+def next_schedule_ts(path: str) -> Optional[int]:
+    row = _conn(path).execute("SELECT MIN(when_ts) FROM schedules WHERE status='pending'").fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+@_on_db_thread
+def _release_orphan_reservations(path: str) -> List[int]:
     c = _conn(path)
-    c.execute("UPDATE drafts SET deleted=0 WHERE message_id=?", (message_id,))
+    cond = (
+        "sent=0 AND schedule_id IS NOT NULL AND schedule_id NOT IN "
+        f"(SELECT id FROM schedules WHERE status IN {_ACTIVE})"
+    )
+    ids = [int(r[0]) for r in c.execute(f"SELECT message_id FROM drafts WHERE {cond}").fetchall()]
+    if ids:
+        c.execute(f"UPDATE drafts SET schedule_id=NULL WHERE {cond}")
+        c.commit()
+    return ids
+
+async def release_orphan_reservations(path: str) -> List[int]:
+    """Libera reservas cuya programación ya no está viva (terminada, cancelada o inexistente)."""
+    ids = await _release_orphan_reservations(path)
+    pending_index(path).release(ids)
+    return ids
+
+# ========= velocidad por target =========
+THROUGHPUT_ALPHA = 0.3  # peso de la última medición en la media móvil
+
+@_on_db_thread
+def record_throughput(path: str, target_chat_id: int, sec_per_unit: float):
+    c = _conn(path)
+    c.execute(
+        "INSERT INTO throughput(target_chat_id, sec_per_unit) VALUES (?, ?) "
+        "ON CONFLICT(target_chat_id) DO UPDATE SET "
+        "  sec_per_unit = sec_per_unit + ? * (excluded.sec_per_unit - sec_per_unit), "
+        "  samples = samples + 1, updated_at = strftime('%s','now')",
+        (int(target_chat_id), float(sec_per_unit), THROUGHPUT_ALPHA),
+    )
     c.commit()
 
+@_on_db_thread
+def get_throughput(path: str, target_chat_ids: Iterable[int]) -> Dict[int, float]:
+    """{target: segundos por llamada} de los targets con historial."""
+    rows = _conn(path).execute(
+        "SELECT target_chat_id, sec_per_unit FROM throughput "
+        "WHERE target_chat_id IN (SELECT value FROM json_each(?))",
+        (json.dumps([int(t) for t in target_chat_ids]),)
+    ).fetchall()
+    return {int(t): float(v) for (t, v) in rows}
+
+@_on_db_thread
 def get_last_deleted(path: str) -> Optional[int]:
     c = _conn(path)
     cur = c.execute(
@@ -79,14 +736,35 @@ def get_last_deleted(path: str) -> Optional[int]:
     row = cur.fetchone()
     return int(row[0]) if row else None
 
+@_on_db_thread
 def count_deleted_unsent(path: str) -> int:
     c = _conn(path)
     cur = c.execute("SELECT COUNT(*) FROM drafts WHERE sent=0 AND deleted=1")
     row = cur.fetchone()
     return int(row[0] or 0)
 
+@_on_db_thread
 def get_draft_snippet(path: str, message_id: int) -> Optional[str]:
     c = _conn(path)
     cur = c.execute("SELECT snippet FROM drafts WHERE message_id=?", (message_id,))
     row = cur.fetchone()
     return row[0] if row else None
+
+@_on_db_thread
+def _close_all():
+    for conn in _conn_cache.values():
+        try:
+            conn.commit()
+            conn.close()
+        except Exception:
+            pass
+    _conn_cache.clear()
+
+async def close_db():
+    """Vacía el write-behind y cierra las conexiones (en su hilo) al apagar el bot."""
+    for path in list(_save_buffer):
+        await flush_drafts(path)
+    if _flush_tasks:
+        await asyncio.gather(*_flush_tasks, return_exceptions=True)
+    await _close_all()
+    _DB_EXECUTOR.shutdown(wait=True)
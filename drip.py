@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Curvas del modo goteo (/goteo): reparten N envíos dentro de una ventana [inicio, fin].
+# Cada curva es la fracción acumulada publicada C(t) con t ∈ [0, 1] (0 = inicio, 1 = fin);
+# el envío k de N sale en el primer t con C(t) >= k/(N-1).
+from typing import Callable, List, Optional
+
+CURVES = {
+    "lineal": lambda t: t,                    # ritmo constante
+    "rapido": lambda t: 1 - (1 - t) ** 2,     # mucho al principio, se frena al final
+    "lento": lambda t: t * t,                 # poco al principio, se acelera al final
+    "s": lambda t: t * t * (3 - 2 * t),       # arranca y termina suave, más denso en el medio
+}
+DEFAULT_CURVE = "lineal"
+
+def _parse_weights(txt: str) -> Optional[List[float]]:
+    try:
+        weights = [float(w) for w in txt.split(",") if w.strip()]
+    except ValueError:
+        return None
+    if not weights or any(w < 0 for w in weights) or sum(weights) <= 0:
+        return None
+    return weights
+
+def parse_curve(txt: str) -> Optional[str]:
+    """
+    Normaliza la curva escrita por el usuario. Acepta un nombre de CURVES o pesos por
+    tramos iguales de la ventana, p. ej. '1,3,1' (el tramo central recibe el triple).
+    Devuelve la especificación canónica a guardar, o None si no es válida.
+    """
+    v = (txt or "").strip().lower()
+    if v in ("rápido", "rápida", "rapida"):
+        v = "rapido"
+    if v in CURVES:
+        return v
+    if v.startswith("pesos:"):
+        v = v[len("pesos:"):]
+    weights = _parse_weights(v)
+    if weights is None:
+        return None
+    return "pesos:" + ",".join(f"{w:g}" for w in weights)
+
+def _curve_fn(spec: Optional[str]) -> Callable[[float], float]:
+    spec = spec or DEFAULT_CURVE
+    if spec in CURVES:
+        return CURVES[spec]
+    weights = _parse_weights(spec[len("pesos:"):]) if spec.startswith("pesos:") else None
+    if weights is None:
+        return CURVES[DEFAULT_CURVE]
+    total = sum(weights)
+    m = len(weights)
+
+    def piecewise(t: float) -> float:
+        pos = min(max(t, 0.0), 1.0) * m
+        full = min(int(pos), m - 1)
+        return (sum(weights[:full]) + weights[full] * (pos - full)) / total
+
+    return piecewise
+
+def slot_ts(start_ts: int, end_ts: int, k: int, n: int, spec: Optional[str]) -> int:
+    """Momento (epoch) del envío k (0-based) de n, según la curva `spec`."""
+    if n <= 1 or end_ts <= start_ts:
+        return int(start_ts)
+    target = min(1.0, max(0.0, k / (n - 1)))
+    curve = _curve_fn(spec)
+    lo, hi = 0.0, 1.0
+    for _ in range(40):  # todas las curvas son monótonas: bisección
+        mid = (lo + hi) / 2
+        if curve(mid) >= target:
+            hi = mid
+        else:
+            lo = mid
+    return int(start_ts + hi * (end_ts - start_ts))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Ediciones en BORRADOR (edited_channel_post).
+# Actualizan el borrador guardado y, si ya salió, sus copias en cada target (mapa `deliveries`).
+# Las ráfagas de ediciones del mismo mensaje se agrupan: solo se aplica la última versión,
+# pasados EDIT_DEBOUNCE segundos sin cambios. Una sola tarea con un heap de vencimientos.
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Message
+from telegram.error import TelegramError
+
+from config import DB_FILE
+from database import update_draft, get_deliveries
+from outbox import limited, priority, MANUAL
+from send_plan import build_send_plan, encode_plan
+
+logger = logging.getLogger(__name__)
+
+EDIT_DEBOUNCE = 3.0
+
+async def _propagate(bot, msg: Message) -> Tuple[int, int]:
+    """Aplica el texto/caption nuevo a cada copia publicada. Devuelve (actualizadas, copias)."""
+    copies = await get_deliveries(DB_FILE, msg.message_id)
+    if not copies or msg.poll is not None:  # las encuestas no se pueden editar
+        return 0, len(copies)
+    ok = 0
+    for target, posted in copies:
+        if msg.text is not None:
+            factory = lambda t=target, p=posted: bot.edit_message_text(
+                msg.text, chat_id=t, message_id=p, entities=msg.entities)
+        else:
+            factory = lambda t=target, p=posted: bot.edit_message_caption(
+                chat_id=t, message_id=p, caption=msg.caption, caption_entities=msg.caption_entities)
+        try:
+            await limited(target, factory)
+            ok += 1
+        except TelegramError as e:
+            if "not modified" in str(e).lower():
+                ok += 1
+            else:
+                logger.warning(f"No pude editar la copia {posted} en {target} → {e}")
+    return ok, len(copies)
+
+async def apply_edit(bot, msg: Message) -> Optional[int]:
+    """Guarda la versión editada del borrador y la propaga. Devuelve la versión (None si no era borrador)."""
+    raw = msg.to_dict()
+    snippet = msg.text or msg.caption or ""
+    version = await update_draft(DB_FILE, msg.message_id, snippet, raw, msg.media_group_id,
+                                 encode_plan(build_send_plan(raw)))
+    if version is None:
+        return None  # comandos y mensajes que nunca se guardaron
+    with priority(MANUAL):
+        ok, total = await _propagate(bot, msg)
+    if total:
+        logger.info(f"Edición de {msg.message_id} (v{version}) aplicada a {ok}/{total} copias publicadas.")
+    else:
+        logger.info(f"Edición de {msg.message_id} guardada (v{version}).")
+    return version
+
+class EditCoalescer:
+    """Retiene la última edición de cada mensaje y la aplica cuando deja de cambiar."""
+
+    def __init__(self, debounce: float = EDIT_DEBOUNCE):
+        self.debounce = debounce
+        self._latest: Dict[int, Tuple[float, Message]] = {}  # message_id -> (vence, última versión)
+        self._heap: List[Tuple[float, int]] = []
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def submit(self, bot, msg: Message):
+        self._bot = bot
+        due = time.monotonic() + self.debounce
+        self._latest[msg.message_id] = (due, msg)  # la anterior (si había) queda descartada
+        heapq.heappush(self._heap, (due, msg.message_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wake.set()
+
+    def _pop_due(self, now: float) -> List[Message]:
+        due: List[Message] = []
+        while self._heap and self._heap[0][0] <= now:
+            when, mid = heapq.heappop(self._heap)
+            entry = self._latest.get(mid)
+            if entry and entry[0] == when:  # entradas viejas del heap se ignoran
+                del self._latest[mid]
+                due.append(entry[1])
+        return due
+
+    async def _apply(self, msgs: List[Message]):
+        for msg in msgs:
+            try:
+                await apply_edit(self._bot, msg)
+            except Exception as e:
+                logger.exception(f"Error aplicando edición de {msg.message_id}: {e}")
+
+    async def _run(self):
+        while self._heap:
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            await self._apply(self._pop_due(time.monotonic()))
+
+    async def shutdown(self):
+        """Aplica ya lo que estuviera esperando y para la tarea (en post_stop: necesita el bot abierto)."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._latest and self._bot is not None:
+            await self._apply([msg for (_due, msg) in self._latest.values()])
+        self._latest.clear()
+        self._heap.clear()
+
+EDITS = EditCoalescer()
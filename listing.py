@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# /listar paginado: cada página trae solo sus entradas (paginación por clave sobre el
+# message_id de la primera entrada) y se navega con botones ⬅️/➡️ que editan el mismo mensaje.
+# Las páginas ya renderizadas se guardan hasta que cambia la cola (PendingIndex.version);
+# el pie de programaciones no depende de la cola (un goteo avanza sin tocarla) y se arma siempre.
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import DB_FILE, TZNAME
+from database import pending_index
+from scheduler import list_schedules
+
+PAGE_SIZE = 25        # entradas por página (un álbum = una entrada)
+SNIPPET_CHARS = 60
+MAX_SCHEDULE_LINES = 10
+
+_cache: Dict[Tuple[str, Optional[int]], Tuple[str, Optional[InlineKeyboardMarkup]]] = {}
+_cache_version: Optional[int] = None
+
+def parse_cursor(data: str) -> Tuple[str, Optional[int]]:
+    """'l:n:123' -> ('n', 123) · 'l:p:123' -> ('p', 123) · otro -> ('n', None) (primera página)."""
+    parts = (data or "").split(":")
+    if len(parts) == 3 and parts[1] in ("n", "p") and parts[2].lstrip("-").isdigit():
+        return parts[1], int(parts[2])
+    return "n", None
+
+def _entry_line(pos: int, did: int, snip: str, ids: List[int]) -> str:
+    s = (snip or "").strip()
+    if len(s) > SNIPPET_CHARS:
+        s = s[:SNIPPET_CHARS] + "…"
+    if len(ids) > 1:
+        return f"• {pos:>2} — 🖼 Álbum ({len(ids)}) {s}  (id:{did}–{ids[-1]})"
+    return f"• {pos:>2} — {s or '[contenido]'}  (id:{did})"
+
+async def _schedules_footer() -> List[str]:
+    scheds = await list_schedules()
+    if not scheds:
+        return ["\n🗒 Programaciones pendientes: 0"]
+    out = ["\n🗒 Programaciones pendientes:"]
+    for pid, when, _status, count in scheds[:MAX_SCHEDULE_LINES]:
+        out.append(f"• #{pid} — {when:%Y-%m-%d %H:%M} ({TZNAME}) — {count} mensajes")
+    if len(scheds) > MAX_SCHEDULE_LINES:
+        out.append(f"… y {len(scheds) - MAX_SCHEDULE_LINES} más (ver /programados)")
+    return out
+
+async def _render(direction: str, cursor: Optional[int]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    idx = pending_index(DB_FILE)
+    total = len(idx.entries(unscheduled=True))
+    if direction == "p":
+        start, page = idx.page(before=cursor, limit=PAGE_SIZE, unscheduled=True)
+    else:
+        start, page = idx.page(after=cursor, limit=PAGE_SIZE, unscheduled=True)
+
+    if not total:
+        out = ["📋 Borradores pendientes: 0"]
+    else:
+        pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+        out = [f"📋 Borradores pendientes: {total} · página {start // PAGE_SIZE + 1}/{pages}"]
+        out.extend(_entry_line(start + i, did, snip, ids) for i, (did, snip, ids) in enumerate(page, start=1))
+    buttons = []
+    if page and start > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"l:p:{page[0][0]}"))
+    if page and start + len(page) < total:
+        buttons.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"l:n:{page[-1][0]}"))
+    return "\n".join(out), (InlineKeyboardMarkup([buttons]) if buttons else None)
+
+async def render_page(direction: str = "n", cursor: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Texto y teclado de la página pedida; reutiliza las entradas ya renderizadas si la cola no cambió."""
+    global _cache_version
+    version = pending_index(DB_FILE).version
+    if version != _cache_version:
+        _cache.clear()
+        _cache_version = version
+    key = (direction, cursor)
+    if key not in _cache:
+        _cache[key] = await _render(direction, cursor)
+    body, markup = _cache[key]
+    return "\n".join([body, *await _schedules_footer()]), markup
@@ -4,27 +4,35 @@
 # lo publica en PRINCIPAL (y BACKUP si está ON) en el MISMO ORDEN, sin "Forwarded from...".
 # Reconstruye encuestas (quiz/regular) y copia el resto de mensajes.
 
-import json
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Awaitable, Optional
 
 from telegram import Update
-from telegram.ext import Application, MessageHandler, ContextTypes, CallbackQueryHandler, filters
-from telegram.error import TelegramError
+from telegram.ext import Application, BaseUpdateProcessor, MessageHandler, ContextTypes, CallbackQueryHandler, filters
 
 from config import (
     BOT_TOKEN, DB_FILE, TZNAME, TZ,
-    SOURCE_CHAT_ID, TARGET_CHAT_ID, PREVIEW_CHAT_ID
+    SOURCE_CHAT_ID, TARGET_CHAT_ID, PREVIEW_CHAT_ID,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    CONCURRENT_UPDATES,
 )
 from database import (
-    init_db, save_draft, get_unsent_drafts, list_drafts,
-    mark_deleted, restore_draft, get_last_deleted
+    init_db, save_draft, list_draft_groups, pending_index, pending_count,
+    mark_deleted, restore_draft, get_last_deleted, delete_drafts, close_db,
+    list_publish_runs, get_run_messages, mark_run_retracted, clear_preview_copies,
 )
+from send_plan import build_send_plan, encode_plan
+from commands import REGISTRY, Command, parse_id
+from listing import render_page, parse_cursor
+from edits import EDITS
+from outbox import PREVIEW, MANUAL, priority
+import background
 from keyboards import kb_main, text_main, kb_settings, text_settings
-from publisher import publicar_todo_activos, publicar_ids, get_active_targets, STATS, SCHEDULED_LOCK, set_active_backup, is_active_backup
-from scheduler import schedule_ids, cmd_programar, cmd_programados, cmd_desprogramar, SCHEDULES
-from core_utils import temp_notice, extract_id_from_text, deep_link_for_channel_message, parse_nuke_selection
+from publisher import publicar_todo_activos, plan_preview, publicar_preview, get_active_targets, STATS, set_active_backup, is_active_backup
+from scheduler import schedule_ids, cmd_programar, cmd_programados, cmd_desprogramar, cmd_goteo, recover_schedules
+from core_utils import send_text, edit_query, temp_notice, NOTICES, delete_messages_bulk, deep_link_for_channel_message, parse_nuke_selection
 
 # ========= LOGGING =========
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -44,126 +52,176 @@ def _is_command_text(txt: Optional[str]) -> bool:
     return bool(txt and txt.strip().startswith("/"))
 
 async def _delete_user_command_if_possible(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Borra el mensaje de comando del canal (si el bot tiene permiso)."""
-    try:
-        if update and update.channel_post:
-            await context.bot.delete_message(chat_id=SOURCE_CHAT_ID, message_id=update.channel_post.message_id)
-    except TelegramError:
-        pass
+    """Borra el mensaje de comando del canal (si el bot tiene permiso), agrupado con otros borrados."""
+    if update and update.channel_post:
+        NOTICES.expire(context.bot, SOURCE_CHAT_ID, update.channel_post.message_id, 0)
 
 # -------------------------------------------------------
 # Comandos
 # -------------------------------------------------------
 async def _cmd_listar(context: ContextTypes.DEFAULT_TYPE):
-    """Lista borradores (excluyendo programados) y al final muestra programaciones pendientes."""
-    drafts_all = list_drafts(DB_FILE)  # [(id, snip)]
-    drafts = [(did, snip) for (did, snip) in drafts_all if did not in SCHEDULED_LOCK]
-
-    if not drafts:
-        out = ["📋 Borradores pendientes: 0"]
-    else:
-        out = ["📋 Borradores pendientes:"]
-        for i, (did, snip) in enumerate(drafts, start=1):
-            s = (snip or "").strip()
-            if len(s) > 60:
-                s = s[:60] + "…"
-            out.append(f"• {i:>2} — {s or '[contenido]'}  (id:{did})")
-
-    # Programaciones
-    if not SCHEDULES:
-        out.append("\n🗒 Programaciones pendientes: 0")
-    else:
-        from datetime import datetime as _dt
-        now = _dt.now(tz=TZ)
-        out.append("\n🗒 Programaciones pendientes:")
-        for pid, rec in sorted(SCHEDULES.items()):
-            when = rec["when"].astimezone(TZ).strftime("%Y-%m-%d %H:%M")
-            ids = rec["ids"]
-            out.append(f"• #{pid} — {when} ({TZNAME}) — {len(ids)} mensajes")
-
-    await context.bot.send_message(SOURCE_CHAT_ID, "\n".join(out))
+    """Primera página de borradores (excluyendo programados) y las programaciones pendientes."""
+    text, kb = await render_page()
+    await send_text(context.bot, text, reply_markup=kb)
 
-async def _cmd_cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE, txt: str):
+async def _cmd_cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE, mid: Optional[int]):
     """Quita de la cola sin borrar el mensaje del canal."""
-    mid = extract_id_from_text(txt)
     # también aceptar si respondes al mensaje
     if not mid and update.channel_post and update.channel_post.reply_to_message:
         mid = update.channel_post.reply_to_message.message_id
     if not mid:
-        await context.bot.send_message(SOURCE_CHAT_ID, "❌ Usa: /cancelar <id> o responde al mensaje a cancelar.")
+        await send_text(context.bot, "❌ Usa: /cancelar <id> o responde al mensaje a cancelar.")
+        return
+    if pending_index(DB_FILE).is_busy(mid):
+        await temp_notice(context.bot, f"⏳ id:{mid} se está publicando ahora mismo; no se puede cancelar.", ttl=6)
         return
 
-    # Solo marca en DB, no borra del canal
-    mark_deleted(DB_FILE, mid)
-    # Saca de cualquier lock de programación
-    SCHEDULED_LOCK.discard(mid)
+    # Solo marca en DB, no borra del canal (y lo saca de cualquier programación)
+    await mark_deleted(DB_FILE, mid)
     # Contador
     STATS["cancelados"] += 1
 
-    restantes = len(list_drafts(DB_FILE))
+    restantes = pending_count(DB_FILE)
     await temp_notice(context.bot, f"🚫 Cancelado id:{mid}. Quedan {restantes} en la cola.", ttl=6)
 
-async def _cmd_deshacer(update: Update, context: ContextTypes.DEFAULT_TYPE, txt: str):
+async def _cmd_deshacer(update: Update, context: ContextTypes.DEFAULT_TYPE, mid: Optional[int]):
     """Revierte /cancelar. (No aplica a /eliminar)."""
-    mid = extract_id_from_text(txt)
     if not mid and update.channel_post and update.channel_post.reply_to_message:
         mid = update.channel_post.reply_to_message.message_id
     if not mid:
-        mid = get_last_deleted(DB_FILE)
+        mid = await get_last_deleted(DB_FILE)
 
     if not mid:
         await temp_notice(context.bot, "ℹ️ No hay nada para deshacer.", ttl=5)
         return
 
-    restore_draft(DB_FILE, mid)
+    await restore_draft(DB_FILE, mid)
     if STATS["cancelados"] > 0:
         STATS["cancelados"] -= 1
-    restantes = len(list_drafts(DB_FILE))
+    restantes = pending_count(DB_FILE)
     await temp_notice(context.bot, f"↩️ Restaurado id:{mid}. Ahora hay {restantes} en la cola.", ttl=6)
 
-async def _cmd_eliminar(update: Update, context: ContextTypes.DEFAULT_TYPE, txt: str):
+async def _cmd_eliminar(update: Update, context: ContextTypes.DEFAULT_TYPE, mid: Optional[int]):
     """BORRA del canal y lo quita de la cola definitivamente."""
-    mid = extract_id_from_text(txt)
     if not mid and update.channel_post and update.channel_post.reply_to_message:
         mid = update.channel_post.reply_to_message.message_id
     if not mid:
-        await context.bot.send_message(SOURCE_CHAT_ID, "❌ Usa: /eliminar <id> o responde al mensaje a eliminar.")
+        await send_text(context.bot, "❌ Usa: /eliminar <id> o responde al mensaje a eliminar.")
+        return
+    if pending_index(DB_FILE).is_busy(mid):
+        await temp_notice(context.bot, f"⏳ id:{mid} se está publicando ahora mismo; no se puede eliminar.", ttl=6)
         return
 
-    ok_del = True
-    try:
-        await context.bot.delete_message(chat_id=SOURCE_CHAT_ID, message_id=mid)
-    except TelegramError as e:
-        ok_del = False
-        logger.warning(f"No pude borrar en el canal id:{mid} → {e}")
+    ok_del = bool(await delete_messages_bulk(context.bot, SOURCE_CHAT_ID, [mid]))
 
     # Borrado real de la DB
-    try:
-        import sqlite3
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("DELETE FROM drafts WHERE message_id = ?", (mid,))
-        con.commit()
-        con.close()
-    except Exception:
-        pass
+    await delete_drafts(DB_FILE, [mid])
 
-    SCHEDULED_LOCK.discard(mid)
     STATS["eliminados"] += 1
-    restantes = len(list_drafts(DB_FILE))
+    restantes = pending_count(DB_FILE)
     txt_ok = "🗑️ Eliminado del canal y de la cola." if ok_del else "🗑️ Quitado de la cola (no pude borrar en el canal)."
     await temp_notice(context.bot, f"{txt_ok} id:{mid}. Quedan {restantes} en la cola.", ttl=7)
 
-async def _cmd_preview(context: ContextTypes.DEFAULT_TYPE):
-    """Manda la cola a PREVIEW sin marcar como enviada (excluye programados)."""
-    rows_full = get_unsent_drafts(DB_FILE)
-    rows = [(m, t, r) for (m, t, r) in rows_full if m not in SCHEDULED_LOCK]
-    if not rows:
-        await temp_notice(context.bot, "🧪 Preview: 0 mensajes.", ttl=4)
+async def _cmd_enviar(context: ContextTypes.DEFAULT_TYPE):
+    """Publica la cola en segundo plano; el avance se ve en un mensaje que se va editando."""
+    total = len(pending_index(DB_FILE).unscheduled_ids())
+    if not total:
+        await temp_notice(context.bot, "📭 No hay borradores para enviar.", ttl=4)
         return
-    ids = [m for (m, _t, _r) in rows]
-    pubs, fails, _ = await publicar_ids(context, ids=ids, targets=[PREVIEW_CHAT_ID], mark_as_sent=False)
-    await context.bot.send_message(SOURCE_CHAT_ID, f"🧪 Preview: enviados {pubs}, fallidos {fails}.")
+
+    async def work(progress):
+        ok, fail, run_id = await publicar_todo_activos(context, progress=progress)
+        extras = []
+        if STATS["cancelados"]:
+            extras.append(f"Cancelados: {STATS['cancelados']}")
+        if STATS["eliminados"]:
+            extras.append(f"Eliminados: {STATS['eliminados']}")
+        msg_out = f"✅ Publicados {ok}."
+        if run_id:
+            msg_out += f" (tanda #{run_id} · /retirar {run_id} la borra)"
+        if fail:
+            extras.append(f"Fallidos: {fail}")
+        if extras:
+            msg_out += "\n📦 " + " · ".join(extras) + "."
+        STATS["cancelados"] = 0
+        STATS["eliminados"] = 0
+        return msg_out
+
+    if not background.start(context.bot, "enviar", "📤 Enviando", total, work):
+        await temp_notice(context.bot, "⏳ Ya hay un envío en curso; espera a que termine.", ttl=5)
+
+PREVIEW_RESET = ("reset", "todo", "completa")
+
+async def _cmd_preview(context: ContextTypes.DEFAULT_TYPE, arg: str = ""):
+    """
+    Manda a PREVIEW solo lo nuevo o editado desde la última preview (excluye programados),
+    en segundo plano; la copia vieja de lo editado se borra. `/preview reset` borra todo lo
+    anterior de PREVIEW y vuelve a mandar la cola completa.
+    """
+    full = arg.strip().lower() in PREVIEW_RESET
+    if background.is_running("preview"):
+        await temp_notice(context.bot, "⏳ Ya hay una preview en curso; espera a que termine.", ttl=5)
+        return
+    versions, old = await plan_preview(full=full)
+    if not versions and not old:
+        await temp_notice(context.bot, "🧪 Preview al día: nada nuevo ni editado.", ttl=4)
+        return
+
+    async def work(progress):
+        with priority(PREVIEW):
+            borrados = len(await delete_messages_bulk(context.bot, PREVIEW_CHAT_ID, old))
+        if full:
+            await clear_preview_copies(DB_FILE)
+        pubs, fails = await publicar_preview(context, versions=versions, progress=progress)
+        extra = f", {'borrados' if full else 'reemplazados'} {borrados}" if borrados else ""
+        return f"🧪 Preview: enviados {pubs}, fallidos {fails}{extra}."
+
+    # otra /preview pudo arrancar mientras se planificaba (comando y botón a la vez)
+    if not background.start(context.bot, "preview", "🧪 Preview", len(versions), work):
+        await temp_notice(context.bot, "⏳ Ya hay una preview en curso; espera a que termine.", ttl=5)
+
+async def _cmd_retirar(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """Borra de los targets (PRINCIPAL/BACKUP) todo lo publicado en una tanda, con delete_messages."""
+    v = arg.strip().lower()
+    runs = await list_publish_runs(DB_FILE)
+    if not v:
+        if not runs:
+            await send_text(context.bot, "📭 No hay tandas publicadas.")
+            return
+        out = ["📚 Últimas tandas publicadas:"]
+        for run_id, sched, created, retracted, count in runs:
+            when = datetime.fromtimestamp(created, tz=TZ)
+            origen = f"programación #{sched}" if sched else "manual"
+            estado = " · retirada" if retracted else ""
+            out.append(f"• #{run_id} — {when:%Y-%m-%d %H:%M} — {origen} — {count} mensajes{estado}")
+        out.append("\nUsa /retirar <n> o /retirar ultima.")
+        await send_text(context.bot, "\n".join(out))
+        return
+
+    if v in ("ultima", "última", "last"):
+        run_id = next((r[0] for r in runs if not r[3]), None)
+    elif v.lstrip("#").isdigit():
+        run_id = int(v.lstrip("#"))
+    else:
+        run_id = None
+    if run_id is None:
+        await send_text(context.bot, "Usa: /retirar [n|ultima]")
+        return
+
+    msgs = await get_run_messages(DB_FILE, run_id)
+    if not msgs:
+        await send_text(context.bot, f"No hay mensajes publicados en la tanda #{run_id}.")
+        return
+    total = sum(len(ids) for ids in msgs.values())
+    borrados = 0
+    with priority(MANUAL):
+        for target, ids in msgs.items():
+            borrados += len(await delete_messages_bulk(context.bot, target, ids))
+    await mark_run_retracted(DB_FILE, run_id)
+    txt_out = f"🧹 Tanda #{run_id} retirada: {borrados}/{total} mensajes borrados."
+    if borrados < total:
+        txt_out += " (Telegram no deja borrar algunos, p. ej. los de más de 48 h)"
+    await send_text(context.bot, txt_out)
 
 async def _cmd_backup(context: ContextTypes.DEFAULT_TYPE, arg: str):
     v = (arg or "").strip().lower()
@@ -172,51 +230,124 @@ async def _cmd_backup(context: ContextTypes.DEFAULT_TYPE, arg: str):
     elif v in ("off", "0", "false", "no"):
         set_active_backup(False)
     else:
-        await context.bot.send_message(SOURCE_CHAT_ID, "Usa: /backup on|off")
+        await send_text(context.bot, "Usa: /backup on|off")
         return
-    await context.bot.send_message(SOURCE_CHAT_ID, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
+    await send_text(context.bot, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
 
 # ---------- NUKE ----------
-async def _cmd_nuke(context: ContextTypes.DEFAULT_TYPE, txt: str):
-    parts = (txt or "").split(maxsplit=1)
-    arg = parts[1] if len(parts) > 1 else ""
-
-    drafts = list_drafts(DB_FILE)
-    from core_utils import parse_nuke_selection as _sel
-    victims = _sel(arg, drafts)
+async def _cmd_nuke(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    drafts = list_draft_groups(DB_FILE)
+    victims = parse_nuke_selection(arg, drafts)
 
     if not drafts:
-        await context.bot.send_message(SOURCE_CHAT_ID, "No hay pendientes.")
+        await send_text(context.bot, "No hay pendientes.")
         return
 
     if not victims:
-        await context.bot.send_message(
-            SOURCE_CHAT_ID,
+        await send_text(
+            context.bot,
             "Usa: /nuke all | /nuke todos | /nuke 1,3,5 | /nuke 1-10 | /nuke N"
         )
         return
 
-    borrados = 0
-    import sqlite3
-    for mid in sorted(victims, reverse=True):
-        try:
-            await context.bot.delete_message(chat_id=SOURCE_CHAT_ID, message_id=mid)
-        except TelegramError as e:
-            logger.warning(f"No pude borrar en el canal id:{mid} → {e}")
-        try:
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.execute("DELETE FROM drafts WHERE message_id = ?", (mid,))
-            con.commit()
-            con.close()
-        except Exception:
-            pass
-        SCHEDULED_LOCK.discard(mid)
-        borrados += 1
+    # lo que está saliendo en una publicación en curso no se toca (llegaría solo a unos targets)
+    idx = pending_index(DB_FILE)
+    busy = [mid for mid in victims if idx.is_busy(mid)]
+    victims = [mid for mid in victims if not idx.is_busy(mid)]
+
+    # Canal: delete_messages en tandas de 100 · DB: un solo DELETE … IN (…)
+    if victims:
+        await delete_messages_bulk(context.bot, SOURCE_CHAT_ID, victims)
+        await delete_drafts(DB_FILE, victims)
+    borrados = len(victims)
 
     STATS["eliminados"] += borrados
-    restantes = len(list_drafts(DB_FILE))
-    await context.bot.send_message(SOURCE_CHAT_ID, f"💣 Nuke: {borrados} borrados. Quedan {restantes} en la cola.")
+    restantes = pending_count(DB_FILE)
+    txt_out = f"💣 Nuke: {borrados} borrados. Quedan {restantes} en la cola."
+    if busy:
+        txt_out += f" ({len(busy)} no se tocaron porque se están publicando ahora mismo)"
+    await send_text(context.bot, txt_out)
+
+async def _cmd_id(update: Update, context: ContextTypes.DEFAULT_TYPE, mid: Optional[int]):
+    if mid is None and update.channel_post and update.channel_post.reply_to_message:
+        rid = update.channel_post.reply_to_message.message_id
+        await send_text(context.bot, f"🆔 ID del mensaje: {rid}")
+        return
+    if not mid:
+        await send_text(context.bot, "Usa: /id <id> o responde a un mensaje con /id.")
+        return
+    link = deep_link_for_channel_message(SOURCE_CHAT_ID, mid)
+    await send_text(context.bot, f"🆔 {mid}\n• Enlace: {link}")
+
+async def _cmd_programar(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str):
+    if not arg:
+        await send_text(
+            context.bot,
+            "Usa: `/programar YYYY-MM-DD HH:MM [llegar|centrar]` (24h: 00:00–23:59, sin '(24h)' ni AM/PM).",
+            parse_mode="Markdown"
+        )
+        return
+    await cmd_programar(context, arg)
+
+# -------------------------------------------------------
+# Registro: despacho, panel /comandos y menú del bot salen de aquí
+# -------------------------------------------------------
+for _c in (
+    Command("comandos", lambda u, c, a: send_text(c.bot, text_main(), reply_markup=kb_main()),
+            aliases=("comando", "ayuda", "start"), menu="Ver ayuda y botones"),
+    Command("listar", lambda u, c, a: _cmd_listar(c), aliases=("lista",),
+            help="muestra borradores pendientes (excluye los programados)",
+            menu="Mostrar borradores pendientes (excluye programados)"),
+    Command("enviar", lambda u, c, a: _cmd_enviar(c),
+            help="publica ahora a targets activos (principal y, si ON, backup)",
+            menu="Publicar ahora a targets activos"),
+    Command("preview", lambda u, c, a: _cmd_preview(c, a), usage="[reset]",
+            help="manda a PREVIEW lo nuevo o editado desde la última preview, sin marcarlo como enviado. "
+                 "Con reset borra lo que había en PREVIEW y manda la cola completa",
+            menu="Enviar a PREVIEW lo nuevo o editado ([reset])"),
+    Command("programar", _cmd_programar, usage="YYYY-MM-DD HH:MM [llegar|centrar]",
+            help="programa lo que está en /listar (formato 24h: 00:00–23:59, sin '(24h)' ni AM/PM). "
+                 "Bloquea esos IDs hasta ejecutarse y no se mezclan con nuevos. Añade llegar para que el "
+                 "último mensaje llegue a esa hora o centrar para centrar la tanda en ella (según la velocidad medida)",
+            menu="Programar (24h: YYYY-MM-DD HH:MM [llegar|centrar])"),
+    Command("goteo", lambda u, c, a: cmd_goteo(c, a), usage="<inicio> <fin> [curva] [N]",
+            help="reparte lo de /listar (o los N primeros) entre inicio y fin (HH:MM o YYYY-MM-DD HH:MM). "
+                 "Curvas: lineal, rapido, lento, s o pesos como 1,3,1",
+            menu="Repartir envíos en una ventana (inicio fin [curva] [N])"),
+    Command("programados", lambda u, c, a: cmd_programados(c),
+            help="muestra las programaciones pendientes con su cantidad e ETA (en goteos, progreso y fin)",
+            menu="Ver programaciones pendientes"),
+    Command("desprogramar", lambda u, c, a: cmd_desprogramar(c, a), usage="<id|all>",
+            help="cancela una programación por ID o todas",
+            menu="Cancelar una programación (id|all)"),
+    Command("cancelar", _cmd_cancelar, aliases=("cancel", "skip"), parse=parse_id, usage="<id>",
+            help="quita de la cola (no borra del canal). También puedes responder a un mensaje con /cancelar",
+            menu="Quitar de la cola (no borra del canal)"),
+    Command("deshacer", _cmd_deshacer, aliases=("undo", "restaurar"), parse=parse_id, usage="[id]",
+            help="revierte el último /cancelar o el que indiques (no aplica a /eliminar)",
+            menu="Revertir el último /cancelar"),
+    Command("eliminar", _cmd_eliminar, aliases=("del", "delete", "remove", "borrar"), parse=parse_id, usage="<id>",
+            help="borra del canal y de la cola",
+            menu="Borrar del canal y de la cola"),
+    Command("nuke", _cmd_nuke, usage="all|todos · 1,3,5 · 1-10 · N",
+            help="borra todos los pendientes, esas posiciones, ese rango o los últimos N",
+            menu="Borrar varios (all | 1,3,5 | 1-10 | N)"),
+    Command("todos", lambda u, c, a: _cmd_nuke(u, c, "all"), aliases=("all",), exact=True),
+    Command("id", _cmd_id, parse=parse_id, usage="[id]",
+            help="info del mensaje (si respondes con /id, te da el ID; si pasas un id, te da el deep‑link)",
+            menu="Mostrar ID del mensaje"),
+    Command("canales", lambda u, c, a: send_text(c.bot, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown"),
+            aliases=("targets", "where"),
+            help="muestra los IDs y estado ON/OFF de los targets",
+            menu="Ver IDs y estado de targets"),
+    Command("retirar", _cmd_retirar, usage="[n|ultima]",
+            help="borra de PRINCIPAL y BACKUP todo lo publicado en una tanda (sin número, lista las últimas)",
+            menu="Borrar una tanda ya publicada"),
+    Command("backup", lambda u, c, a: _cmd_backup(c, a), usage="on|off",
+            help="alterna SOLO el backup (principal siempre ON)",
+            menu="ON/OFF para backup"),
+):
+    REGISTRY.add(_c)
 
 # -------------------------------------------------------
 # Menús / botones (callbacks)
@@ -231,21 +362,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data == "m:list":
             await _cmd_listar(context)
         elif data == "m:send":
-            await temp_notice(context.bot, "⏳ Procesando envío…", ttl=4)
-            ok, fail = await publicar_todo_activos(context)
-            extras = []
-            if STATS["cancelados"]:
-                extras.append(f"Cancelados: {STATS['cancelados']}")
-            if STATS["eliminados"]:
-                extras.append(f"Eliminados: {STATS['eliminados']}")
-            msg_out = f"✅ Publicados {ok}."
-            if fail:
-                extras.append(f"Fallidos: {fail}")
-            if extras:
-                msg_out += "\n📦 " + " · ".join(extras) + "."
-            await context.bot.send_message(SOURCE_CHAT_ID, msg_out)
-            STATS["cancelados"] = 0
-            STATS["eliminados"] = 0
+            await _cmd_enviar(context)
         elif data == "m:preview":
             await _cmd_preview(context)
         elif data == "m:sched":
@@ -267,16 +384,19 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                      InlineKeyboardButton("⬅️ Volver", callback_data="m:back")]
                 ]
             )
-            await q.edit_message_text(text, reply_markup=kb, parse_mode="Markdown")
+            await edit_query(q, text, reply_markup=kb, parse_mode="Markdown")
         elif data == "m:settings":
-            await q.edit_message_text(text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
+            await edit_query(q, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
         elif data == "m:toggle_backup":
             set_active_backup(not is_active_backup())
-            await q.edit_message_text(text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
+            await edit_query(q, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
         elif data == "m:back":
-            await q.edit_message_text(text_main(), reply_markup=kb_main())
+            await edit_query(q, text_main(), reply_markup=kb_main())
 
         # Programación rápida
+        elif data.startswith("l:"):
+            text, kb = await render_page(*parse_cursor(data))
+            await edit_query(q, text, reply_markup=kb)
         elif data.startswith("s:"):
             now = datetime.now(tz=TZ)
             when = None
@@ -295,13 +415,13 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             elif data == "s:clear":
                 await cmd_desprogramar(context, "all")
             elif data == "s:custom":
-                await q.edit_message_text(
+                await edit_query(q,
                     "✍️ Formato manual:\n`/programar YYYY-MM-DD HH:MM` (formato 24h)\n\n⬅️ Usa *Volver* para regresar.",
                     parse_mode="Markdown"
                 )
 
             if when:
-                ids = [did for (did, _snip) in list_drafts(DB_FILE)]
+                ids = pending_index(DB_FILE).unscheduled_ids()
                 if not ids:
                     await temp_notice(context.bot, "📭 No hay borradores para programar.", ttl=6)
                 else:
@@ -324,114 +444,30 @@ async def handle_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # --------- COMANDOS ----------
     if _is_command_text(txt):
-        low = txt.lower()
-
-        if low.startswith("/listar") or low.startswith("/lista"):
-            await _cmd_listar(context)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith(("/cancelar", "/cancel", "/skip")):
-            await _cmd_cancelar(update, context, txt)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith(("/eliminar", "/del", "/delete", "/remove", "/borrar")):
-            await _cmd_eliminar(update, context, txt)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith(("/deshacer", "/undo", "/restaurar")):
-            await _cmd_deshacer(update, context, txt)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/nuke"):
-            await _cmd_nuke(context, txt)
-            await _delete_user_command_if_possible(update, context);  return
-        if low.strip() in ("/all", "/todos"):
-            await _cmd_nuke(context, "/nuke all")
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/enviar"):
-            await temp_notice(context.bot, "⏳ Procesando envío…", ttl=4)
-            ok, fail = await publicar_todo_activos(context)
-            extras = []
-            if STATS["cancelados"]:
-                extras.append(f"Cancelados: {STATS['cancelados']}")
-            if STATS["eliminados"]:
-                extras.append(f"Eliminados: {STATS['eliminados']}")
-            msg_out = f"✅ Publicados {ok}."
-            if fail:
-                extras.append(f"Fallidos: {fail}")
-            if extras:
-                msg_out += "\n📦 " + " · ".join(extras) + "."
-            await context.bot.send_message(SOURCE_CHAT_ID, msg_out)
-            STATS["cancelados"] = 0
-            STATS["eliminados"] = 0
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/preview"):
-            await _cmd_preview(context)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/programar"):
-            parts = txt.split(maxsplit=2)
-            if len(parts) >= 3:
-                when_str = f"{parts[1]} {parts[2]}"
-                await cmd_programar(context, when_str)
-            else:
-                await context.bot.send_message(
-                    SOURCE_CHAT_ID,
-                    "Usa: `/programar YYYY-MM-DD HH:MM` (24h: 00:00–23:59, sin '(24h)' ni AM/PM).",
-                    parse_mode="Markdown"
-                )
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/programados"):
-            await cmd_programados(context)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/desprogramar"):
-            parts = txt.split(maxsplit=1)
-            arg = parts[1] if len(parts) > 1 else ""
-            await cmd_desprogramar(context, arg)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/id"):
-            if update.channel_post and update.channel_post.reply_to_message and len((txt or "").split()) == 1:
-                rid = update.channel_post.reply_to_message.message_id
-                await context.bot.send_message(SOURCE_CHAT_ID, f"🆔 ID del mensaje: {rid}")
-            else:
-                mid = extract_id_from_text(txt) or (txt.split()[1] if len(txt.split()) > 1 and txt.split()[1].isdigit() else None)
-                if not mid:
-                    await context.bot.send_message(SOURCE_CHAT_ID, "Usa: /id <id> o responde a un mensaje con /id.")
-                else:
-                    mid = int(mid)
-                    link = deep_link_for_channel_message(SOURCE_CHAT_ID, mid)
-                    await context.bot.send_message(SOURCE_CHAT_ID, f"🆔 {mid}\n• Enlace: {link}")
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith(("/canales", "/targets", "/where")):
-            await context.bot.send_message(SOURCE_CHAT_ID, text_settings(), reply_markup=kb_settings(), parse_mode="Markdown")
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith("/backup"):
-            parts = txt.split(maxsplit=1)
-            arg = parts[1] if len(parts) > 1 else ""
-            await _cmd_backup(context, arg)
-            await _delete_user_command_if_possible(update, context);  return
-
-        if low.startswith(("/comandos", "/comando", "/ayuda", "/start")):
-            await context.bot.send_message(SOURCE_CHAT_ID, text_main(), reply_markup=kb_main())
-            await _delete_user_command_if_possible(update, context);  return
-
-        await context.bot.send_message(SOURCE_CHAT_ID, "Comando no reconocido. Usa /comandos.")
+        cmd, arg = REGISTRY.resolve(txt)
+        if cmd is None:
+            await send_text(context.bot, "Comando no reconocido. Usa /comandos.")
+        else:
+            await cmd.handler(update, context, cmd.parse(arg))
         await _delete_user_command_if_possible(update, context)
         return
 
     # --------- NO COMANDO → GUARDAR BORRADOR ----------
     snippet = msg.text or msg.caption or ""
-    raw_json = json.dumps(msg.to_dict(), ensure_ascii=False)
-    save_draft(DB_FILE, msg.message_id, snippet, raw_json)
+    raw = msg.to_dict()
+    plan = encode_plan(build_send_plan(raw))
+    await save_draft(DB_FILE, msg.message_id, snippet, raw, msg.media_group_id, plan)
     logger.info(f"Guardado en borrador: {msg.message_id}")
 
+async def handle_channel_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Edición en BORRADOR: se agrupa por mensaje y se aplica al borrador y a sus copias publicadas."""
+    msg = update.edited_channel_post
+    if not msg or msg.chat_id != SOURCE_CHAT_ID:
+        return
+    if _is_command_text(msg.text):
+        return
+    EDITS.submit(context.bot, msg)
+
 # ========= ERROR HANDLER =========
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.exception("Excepción no capturada", exc_info=context.error)
@@ -439,44 +475,92 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
 # ========= set bot commands (menú de comandos) =========
 async def _set_bot_commands(app: Application):
     try:
-        await app.bot.set_my_commands([
-            ("comandos", "Ver ayuda y botones"),
-            ("listar", "Mostrar borradores pendientes (excluye programados)"),
-            ("enviar", "Publicar ahora a targets activos"),
-            ("preview", "Enviar cola a PREVIEW (no marca enviada)"),
-            ("programar", "Programar (24h: YYYY-MM-DD HH:MM)"),
-            ("programados", "Ver programaciones pendientes"),
-            ("desprogramar", "Cancelar una programación (id|all)"),
-            ("cancelar", "Quitar de la cola (no borra del canal)"),
-            ("deshacer", "Revertir el último /cancelar"),
-            ("eliminar", "Borrar del canal y de la cola"),
-            ("nuke", "Borrar varios (all | 1,3,5 | 1-10 | N)"),
-            ("id", "Mostrar ID del mensaje"),
-            ("canales", "Ver IDs y estado de targets"),
-            ("backup", "ON/OFF para backup"),
-        ])
+        await app.bot.set_my_commands(REGISTRY.bot_commands())
     except Exception:
         pass
 
+# ========= arranque =========
+async def _on_startup(app: Application):
+    await _set_bot_commands(app)
+    await recover_schedules(app)
+
+# ========= apagado ordenado =========
+# post_stop corre con el bot aún abierto (lo que borra o edita en Telegram va aquí);
+# post_shutdown corre después de bot.shutdown(), cuando ya no se puede llamar a la API.
+async def _on_stop(app: Application):
+    await background.shutdown()
+    await EDITS.shutdown()
+    await NOTICES.shutdown()
+
+async def _on_shutdown(app: Application):
+    await close_db()
+
 # ========= MAIN =========
+ALLOWED_UPDATES = ["channel_post", "edited_channel_post", "callback_query"]
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Updates en paralelo (un /enviar largo no bloquea nada), salvo los channel_post del
+    BORRADOR: esos se atienden de uno en uno y en orden de llegada, así los borradores
+    se guardan en orden de message_id y un comando ve todo lo publicado antes que él.
+    Las ediciones del BORRADOR entran en la misma cola (nunca adelantan al post original).
+    """
+
+    def __init__(self, max_concurrent_updates: int, ordered_chat_id: int):
+        super().__init__(max_concurrent_updates)
+        self._ordered_chat_id = ordered_chat_id
+        self._lock = asyncio.Lock()  # FIFO: respeta el orden en que llegan
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        post = (update.channel_post or update.edited_channel_post) if isinstance(update, Update) else None
+        if post is not None and post.chat_id == self._ordered_chat_id:
+            async with self._lock:
+                await coroutine
+        else:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
 def main():
     app = (
         Application.builder()
         .token(BOT_TOKEN)
+        .concurrent_updates(OrderedUpdateProcessor(CONCURRENT_UPDATES, SOURCE_CHAT_ID))
         .build()
     )
 
-    app.add_handler(MessageHandler(filters.ChatType.CHANNEL, handle_channel))
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_CHANNEL_POST, handle_channel_edit))
+    app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, handle_channel))
     app.add_handler(CallbackQueryHandler(handle_callback))
 
     app.add_error_handler(on_error)
 
-    logger.info("Bot iniciado 🚀 Escuchando channel_post en el BORRADOR.")
+    logger.info("Bot iniciado 🚀 Escuchando channel_post (y ediciones) en el BORRADOR.")
 
     # set comandos visibles (no afecta al canal si Telegram no los muestra ahí)
-    app.post_init = _set_bot_commands
-
-    app.run_polling(allowed_updates=["channel_post", "callback_query"], drop_pending_updates=True)
+    # y re-arma las programaciones guardadas
+    app.post_init = _on_startup
+    app.post_stop = _on_stop
+    app.post_shutdown = _on_shutdown
+
+    if WEBHOOK_URL:
+        # mismo Application y mismos handlers; solo cambia cómo llegan los updates
+        logger.info(f"Modo webhook: escuchando en {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True,
+        )
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
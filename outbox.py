@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Despachador único de salida hacia Telegram.
+# Todo lo que publica, avisa, edita o borra pasa por aquí con una prioridad:
+#   SCHEDULED (programaciones) > MANUAL (/enviar) > PREVIEW > NOTICE (avisos y menús).
+# - Por chat hay UNA llamada en vuelo; los que esperan salen por prioridad (FIFO a igualdad).
+# - Los tokens del bucket global también se reparten por prioridad: un aviso nunca le
+#   quita cupo a una publicación real.
+# - `lane(chat)` reserva un target durante una tanda entera, para que dos publicaciones
+#   solapadas no se intercalen en el canal.
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+from typing import Dict, List, Optional
+
+from telegram.error import RetryAfter
+
+from ratelimit import LIMITER, RateLimiter, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED, MANUAL, PREVIEW, NOTICE = 0, 1, 2, 3
+
+# Prioridad de la tarea actual (la heredan las tareas que cree, p. ej. asyncio.gather)
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar("outbox_priority", default=NOTICE)
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Todo lo que se envíe dentro del bloque usa la prioridad `level`."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+def current_priority() -> int:
+    return _PRIORITY.get()
+
+class PriorityGate:
+    """Candado cuya cola de espera sale por (prioridad, orden de llegada)."""
+
+    def __init__(self):
+        self._held = False
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, prio: int) -> None:
+        if not self._held and not self._waiters:
+            self._held = True
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [prio, next(self._seq), fut])
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # si el turno llegó justo al cancelar, hay que pasarlo al siguiente
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _prio, _seq, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(True)  # el turno pasa directo al siguiente
+                return
+        self._held = False
+
+    @contextlib.asynccontextmanager
+    async def hold(self, prio: int):
+        await self.acquire(prio)
+        try:
+            yield
+        finally:
+            self.release()
+
+class Outbox:
+    def __init__(self, limiter: RateLimiter):
+        self._limiter = limiter
+        self._calls: Dict[Optional[int], PriorityGate] = {}
+        self._lanes: Dict[int, PriorityGate] = {}
+        self._global = PriorityGate()
+
+    def _gate(self, gates: Dict, chat_id) -> PriorityGate:
+        g = gates.get(chat_id)
+        if g is None:
+            g = gates[chat_id] = PriorityGate()
+        return g
+
+    async def submit(self, chat_id: Optional[int], func_coro_factory, *, prio: Optional[int] = None):
+        """Hace UNA llamada a la API cuando le toque según prioridad y limitador. No reintenta."""
+        prio = current_priority() if prio is None else prio
+        async with self._gate(self._calls, chat_id).hold(prio):
+            if chat_id is not None:
+                await self._limiter.acquire_chat(chat_id)
+            async with self._global.hold(prio):
+                await self._limiter.acquire_global()
+            return await func_coro_factory()
+
+    @contextlib.asynccontextmanager
+    async def lane(self, chat_id: int, *, prio: Optional[int] = None):
+        """Exclusividad sobre `chat_id` durante una tanda completa (orden garantizado por target)."""
+        prio = current_priority() if prio is None else prio
+        async with self._gate(self._lanes, chat_id).hold(prio):
+            yield
+
+OUTBOX = Outbox(LIMITER)
+
+async def limited(chat_id: Optional[int], func_coro_factory, *, retries: int = 3):
+    """Llamada a la API por el despachador, con la prioridad actual. Reintenta solo RetryAfter."""
+    tries = 0
+    while True:
+        try:
+            return await OUTBOX.submit(chat_id, func_coro_factory)
+        except RetryAfter as e:
+            wait = retry_after_seconds(e)
+            LIMITER.penalize(chat_id, wait + 1.0)
+            tries += 1
+            if tries > retries:
+                raise
+            logger.warning(f"RetryAfter en chat {chat_id}: bucket congelado {wait}s …")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Índice en memoria de la cola pendiente (sent=0, deleted=0), ordenado por message_id.
+# Se construye una vez al arrancar y database.py lo mantiene al día en cada alta/baja,
+# así que contar, listar o resolver posiciones de /nuke no necesita tocar SQLite.
+import bisect
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+class PendingIndex:
+    def __init__(self):
+        self._ids: List[int] = []                                # ordenados
+        # id -> (snippet, media_group_id, schedule_id)
+        self._info: Dict[int, Tuple[str, Optional[str], Optional[int]]] = {}
+        self._entries: Dict[bool, List[Tuple[int, str, List[int]]]] = {}
+        self._busy: Set[int] = set()  # en una publicación en curso: ni libres ni reservables
+        self.version = 0
+
+    def _touch(self):
+        self._entries = {}
+        self.version += 1
+
+    def load(self, rows: Iterable[Tuple[int, str, Optional[str], Optional[int]]]):
+        self._info = {int(mid): (snip or "", group, sched) for (mid, snip, group, sched) in rows}
+        self._ids = sorted(self._info)
+        self._touch()
+
+    def add(self, mid: int, snippet: str, group: Optional[str], schedule_id: Optional[int] = None):
+        if mid in self._info:
+            return
+        self._info[mid] = (snippet or "", group, schedule_id)
+        # Lo normal es que llegue el id más alto: append O(1); si no, inserción ordenada
+        if not self._ids or mid > self._ids[-1]:
+            self._ids.append(mid)
+        else:
+            bisect.insort(self._ids, mid)
+        self._touch()
+
+    def update(self, mid: int, snippet: str):
+        info = self._info.get(mid)
+        if info is None or info[0] == (snippet or ""):
+            return
+        self._info[mid] = (snippet or "", info[1], info[2])
+        self._touch()
+
+    def discard(self, ids: Iterable[int]):
+        gone = {mid for mid in ids if mid in self._info}
+        if not gone:
+            return
+        for mid in gone:
+            del self._info[mid]
+        if len(gone) == 1:
+            mid = next(iter(gone))
+            self._ids.pop(bisect.bisect_left(self._ids, mid))
+        else:
+            self._ids = [mid for mid in self._ids if mid not in gone]
+        self._touch()
+
+    def reserve(self, ids: Iterable[int], schedule_id: int):
+        for mid in ids:
+            info = self._info.get(mid)
+            if info and info[2] is None:
+                self._info[mid] = (info[0], info[1], schedule_id)
+        self._touch()
+
+    def release(self, ids: Iterable[int]):
+        for mid in ids:
+            info = self._info.get(mid)
+            if info and info[2] is not None:
+                self._info[mid] = (info[0], info[1], None)
+        self._touch()
+
+    def hold(self, ids: Iterable[int]):
+        """Marca `ids` como en vuelo (los publica una tanda) hasta `unhold`."""
+        self._busy.update(ids)
+        self._touch()
+
+    def unhold(self, ids: Iterable[int]):
+        self._busy.difference_update(ids)
+        self._touch()
+
+    def is_busy(self, mid: int) -> bool:
+        return mid in self._busy
+
+    def schedule_of(self, mid: int) -> Optional[int]:
+        info = self._info.get(mid)
+        return info[2] if info else None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, mid: int) -> bool:
+        return mid in self._info
+
+    def unscheduled_ids(self) -> List[int]:
+        """Libres: ni reservados por una programación ni en una publicación en curso."""
+        return [mid for mid in self._ids if self._info[mid][2] is None and mid not in self._busy]
+
+    def scheduled_ids(self, schedule_id: int) -> List[int]:
+        return [mid for mid in self._ids if self._info[mid][2] == schedule_id]
+
+    def entries(self, unscheduled: bool = False) -> List[Tuple[int, str, List[int]]]:
+        """
+        Cada álbum (mismo media_group_id, consecutivo) es UNA entrada:
+        [(primer_id, snippet, [ids del álbum])]. Con `unscheduled`, sin los reservados
+        por una programación ni los que se están publicando. Se recalcula solo cuando cambia la cola.
+        """
+        if unscheduled not in self._entries:
+            entries: List[Tuple[int, str, List[int]]] = []
+            last_group: Optional[str] = None
+            for mid in self._ids:
+                snip, group, sched = self._info[mid]
+                if unscheduled and (sched is not None or mid in self._busy):
+                    last_group = None
+                    continue
+                if group and group == last_group:
+                    first, first_snip, ids = entries[-1]
+                    ids.append(mid)
+                    if not first_snip and snip:
+                        entries[-1] = (first, snip, ids)
+                    continue
+                entries.append((mid, snip, [mid]))
+                last_group = group
+            self._entries[unscheduled] = entries
+        return self._entries[unscheduled]
+
+    def page(self, *, after: Optional[int] = None, before: Optional[int] = None,
+             limit: int, unscheduled: bool = False) -> Tuple[int, List[Tuple[int, str, List[int]]]]:
+        """
+        Una página de `entries()` por clave (id de la primera entrada), sin recorrer la cola:
+        la que sigue a `after` o la que termina justo antes de `before`.
+        Devuelve (posición de la primera entrada, entradas).
+        """
+        entries = self.entries(unscheduled)
+        key = lambda e: e[0]
+        if before is not None:
+            start = max(0, bisect.bisect_left(entries, before, key=key) - limit)
+        elif after is not None:
+            start = bisect.bisect_right(entries, after, key=key)
+        else:
+            start = 0
+        return start, entries[start:start + limit]
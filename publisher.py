@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
-import json
+import asyncio
 import logging
-from typing import List, Tuple, Dict, Set
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 
 from telegram.error import RetryAfter, TimedOut, NetworkError, TelegramError
 from telegram.ext import ContextTypes
 
-from config import DB_FILE, SOURCE_CHAT_ID, TARGET_CHAT_ID, BACKUP_CHAT_ID, PAUSE
-from database import get_unsent_drafts, mark_sent
+from config import DB_FILE, SOURCE_CHAT_ID, TARGET_CHAT_ID, BACKUP_CHAT_ID, PREVIEW_CHAT_ID
+from database import (
+    Draft, iter_unsent_drafts, mark_sent, record_deliveries, get_delivered_pending,
+    record_throughput, get_throughput, start_publish_run,
+    pending_index, preview_state, record_preview_copies, list_preview_copies,
+)
+from ratelimit import LIMITER, retry_after_seconds
+from outbox import OUTBOX, SCHEDULED, MANUAL, PREVIEW, priority
 
 logger = logging.getLogger(__name__)
 
@@ -29,42 +36,31 @@ def get_active_targets() -> List[int]:
         targets.append(BACKUP_CHAT_ID)
     return targets
 
-# ========= Contadores / locks (usados por otros módulos) =========
+# ========= Contadores (usados por otros módulos) =========
 STATS = {"cancelados": 0, "eliminados": 0}
-SCHEDULED_LOCK: Set[int] = set()
 
 # ========= Backoff para envíos =========
-async def _send_with_backoff(func_coro_factory, *, base_pause: float):
+async def _send_with_backoff(func_coro_factory, *, chat_id: int):
+    """Cada intento pide turno al despachador de salida; RetryAfter congela el bucket del chat."""
     tries = 0
     while True:
         try:
-            msg = await func_coro_factory()
-            # pausa corta entre mensajes
-            import asyncio
-            await asyncio.sleep(max(0.0, base_pause))
+            msg = await OUTBOX.submit(chat_id, func_coro_factory)
             return True, msg
         except RetryAfter as e:
-            wait = getattr(e, "retry_after", None)
-            if wait is None:
-                import re
-                m = re.search(r"Retry in (\d+)", str(e))
-                wait = int(m.group(1)) if m else 3
-            logger.warning(f"RetryAfter: esperando {wait}s …")
-            import asyncio
-            await asyncio.sleep(wait + 1.0);  tries += 1
+            wait = retry_after_seconds(e)
+            logger.warning(f"RetryAfter: bucket de {chat_id} congelado {wait}s …")
+            LIMITER.penalize(chat_id, wait + 1.0);  tries += 1
         except TimedOut:
             logger.warning("TimedOut: esperando 3s …")
-            import asyncio
             await asyncio.sleep(3.0);  tries += 1
         except NetworkError:
             logger.warning("NetworkError: esperando 3s …")
-            import asyncio
             await asyncio.sleep(3.0);  tries += 1
         except TelegramError as e:
             if "Flood control exceeded" in str(e):
-                logger.warning("Flood control… esperando 5s …")
-                import asyncio
-                await asyncio.sleep(5.0);  tries += 1
+                logger.warning("Flood control… bucket congelado 5s …")
+                LIMITER.penalize(chat_id, 5.0);  tries += 1
             else:
                 logger.error(f"TelegramError no recuperable: {e}")
                 return False, None
@@ -76,125 +72,312 @@ async def _send_with_backoff(func_coro_factory, *, base_pause: float):
             logger.error("Demasiados reintentos; abandono este mensaje.")
             return False, None
 
-# ========= Encuestas =========
-def _poll_payload_from_raw(raw: dict):
-    p = raw.get("poll") or {}
-    question = p.get("question", "Pregunta")
-    options_src = p.get("options", []) or []
-    options  = [o.get("text", "") for o in options_src]
-
-    is_anon  = p.get("is_anonymous", True)
-    allows_multiple = p.get("allows_multiple_answers", False)
-    ptype = (p.get("type") or "regular").lower().strip()
-    is_quiz = (ptype == "quiz")
-
-    kwargs = dict(
-        question=question,
-        options=options,
-        is_anonymous=is_anon,
-    )
-
-    if not is_quiz:
-        kwargs["allows_multiple_answers"] = bool(allows_multiple)
-
-    if is_quiz:
-        kwargs["type"] = "quiz"
-        cid = p.get("correct_option_id")
-        try:
-            cid = int(cid) if cid is not None else None
-        except Exception:
-            cid = None
-        if cid is None or cid < 0 or cid >= len(options):
-            cid = 0
-        kwargs["correct_option_id"] = cid
-
-    if p.get("open_period") is not None and p.get("close_date") is None:
-        try:
-            kwargs["open_period"] = int(p["open_period"])
-        except Exception:
-            pass
-    elif p.get("close_date") is not None:
-        try:
-            kwargs["close_date"] = int(p["close_date"])
-        except Exception:
-            pass
+# ========= Publicadores =========
+# copy_messages acepta hasta 100 ids por llamada
+COPY_BATCH = 100
 
-    if is_quiz and p.get("explanation"):
-        kwargs["explanation"] = str(p["explanation"])
+async def _build_units(drafts: AsyncIterator[Draft]) -> AsyncIterator[Tuple[str, List[List[int]], dict]]:
+    """
+    Agrupa los borradores (en streaming) en unidades de envío, respetando el orden:
+      - ("poll", [[mid]], kwargs) → encuesta reconstruida con send_poll (kwargs del plan)
+      - ("copy", [[mid], [a1, a2, …], …], {}) → tramo consecutivo de no-encuestas para copy_messages.
+        Cada sublista es un mensaje suelto o un álbum completo; un álbum nunca se parte entre
+        dos llamadas y el tramo no pasa de COPY_BATCH ids (salvo que el álbum solo ya lo haga).
+    """
+    run: List[List[int]] = []
+    run_len = 0
+    cur: List[int] = []          # mensaje suelto o álbum en curso
+    cur_group: Optional[str] = None
+    async for d in drafts:
+        plan = d.plan
+        is_poll = plan.get("k") == "poll"
+        if cur and d.media_group_id and d.media_group_id == cur_group and not is_poll:
+            cur.append(d.message_id)
+            continue
+        if cur:
+            if run and run_len + len(cur) > COPY_BATCH:
+                yield ("copy", run, {})
+                run, run_len = [], 0
+            run.append(cur)
+            run_len += len(cur)
+            cur, cur_group = [], None
+        if is_poll:
+            if run:
+                yield ("copy", run, {})
+                run, run_len = [], 0
+            yield ("poll", [[d.message_id]], plan.get("poll") or {})
+            continue
+        cur, cur_group = [d.message_id], d.media_group_id
+    if cur:
+        if run and run_len + len(cur) > COPY_BATCH:
+            yield ("copy", run, {})
+            run = []
+        run.append(cur)
+    if run:
+        yield ("copy", run, {})
 
-    return kwargs, is_quiz
+async def _copiar_uno(context: ContextTypes.DEFAULT_TYPE, dest: int, mid: int) -> List[Tuple[int, Optional[int]]]:
+    coro_factory = lambda: context.bot.copy_message(chat_id=dest, from_chat_id=SOURCE_CHAT_ID, message_id=mid)
+    ok, msg = await _send_with_backoff(coro_factory, chat_id=dest)
+    if not ok:
+        return []
+    return [(mid, getattr(msg, "message_id", None))]
 
-# ========= Publicadores =========
-async def _publicar_rows(context: ContextTypes.DEFAULT_TYPE, *, rows: List[Tuple[int, str, str]],
-                         targets: List[int], mark_as_sent: bool) -> Tuple[int, int, Dict[int, List[int]]]:
-    publicados = 0
-    fallidos = 0
-    enviados_ids: List[int] = []
-    posted_by_target: Dict[int, List[int]] = {t: [] for t in targets}
-
-    for mid, _t, raw in rows:
-        try:
-            data = json.loads(raw or "{}")
-        except Exception:
-            data = {}
-
-        any_success = False
-        for dest in targets:
-            if "poll" in data:
-                base_kwargs, _ = _poll_payload_from_raw(data)
-                kwargs = dict(base_kwargs)
-                kwargs["chat_id"] = dest
-                coro_factory = lambda k=kwargs: context.bot.send_poll(**k)
-                ok, msg = await _send_with_backoff(coro_factory, base_pause=PAUSE)
-            else:
-                coro_factory = lambda d=dest, m=mid: context.bot.copy_message(
-                    chat_id=d, from_chat_id=SOURCE_CHAT_ID, message_id=m
-                )
-                ok, msg = await _send_with_backoff(coro_factory, base_pause=PAUSE)
-
-            if ok:
-                any_success = True
-                if msg and getattr(msg, "message_id", None):
-                    posted_by_target[dest].append(msg.message_id)
-
-        if any_success:
-            publicados += 1
-            if mark_as_sent:
-                enviados_ids.append(mid)
+async def _copiar_lote(context: ContextTypes.DEFAULT_TYPE, dest: int, mids: List[int]) -> Optional[List[Tuple[int, Optional[int]]]]:
+    """Una sola llamada copy_messages. None si la llamada falló entera."""
+    coro_factory = lambda: context.bot.copy_messages(chat_id=dest, from_chat_id=SOURCE_CHAT_ID, message_ids=mids)
+    ok, copied = await _send_with_backoff(coro_factory, chat_id=dest)
+    if not ok:
+        return None
+    copied = list(copied or ())
+    if len(copied) == len(mids):
+        return [(mid, c.message_id) for mid, c in zip(mids, copied)]
+    # Telegram omite en silencio lo que no puede copiar: no hay forma fiable de
+    # saber cuál faltó, así que se da el lote por entregado sin mapeo por borrador.
+    logger.warning(f"copy_messages a {dest}: {len(copied)}/{len(mids)} copiados")
+    return [(mid, None) for mid in mids]
+
+class _DeliveryJournal:
+    """
+    Acumula entregas (draft, target, posted_id) y las vuelca a `deliveries` en lotes pequeños.
+    Si el proceso muere a mitad de envío, se repiten como mucho FLUSH_EVERY mensajes por target.
+    La tanda (publish_runs) se abre con la primera entrega: sin entregas no queda tanda vacía.
+    """
+    FLUSH_EVERY = 10
+
+    def __init__(self, schedule_id: Optional[int] = None):
+        self.schedule_id = schedule_id
+        self.run_id: Optional[int] = None
+        self._pending: List[Tuple[int, int, Optional[int]]] = []
+        self._lock = asyncio.Lock()  # los workers de cada target comparten diario (y tanda)
+
+    async def add(self, dest: int, pairs: List[Tuple[int, Optional[int]]]) -> None:
+        self._pending.extend((mid, dest, pid) for (mid, pid) in pairs)
+        if len(self._pending) >= self.FLUSH_EVERY:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            if self.run_id is None:
+                self.run_id = await start_publish_run(DB_FILE, self.schedule_id)
+            await record_deliveries(DB_FILE, [(mid, dest, pid, self.run_id) for (mid, dest, pid) in rows])
+
+async def _enviar_unidad(context: ContextTypes.DEFAULT_TYPE, dest: int,
+                         kind: str, groups: List[List[int]], data: dict) -> List[Tuple[int, Optional[int]]]:
+    """Envía una unidad de _build_units a `dest`. Devuelve [(draft_id, posted_id)] de lo entregado."""
+    if kind == "poll":
+        kwargs = dict(data)
+        kwargs["chat_id"] = dest
+        ok, msg = await _send_with_backoff(lambda: context.bot.send_poll(**kwargs), chat_id=dest)
+        return [(groups[0][0], getattr(msg, "message_id", None))] if ok else []
+
+    mids = [m for g in groups for m in g]
+    if len(mids) == 1:
+        return await _copiar_uno(context, dest, mids[0])
+
+    pairs = await _copiar_lote(context, dest, mids)
+    if pairs is not None or len(groups) == 1:
+        return pairs or []
+
+    # El lote entero falló: grupo a grupo (los álbumes siguen yendo juntos) para aislar al culpable
+    got: List[Tuple[int, Optional[int]]] = []
+    for g in groups:
+        if len(g) == 1:
+            got.extend(await _copiar_uno(context, dest, g[0]))
         else:
-            fallidos += 1
+            got.extend(await _copiar_lote(context, dest, g) or [])
+    return got
+
+class Progress:
+    """Avance de una tanda en curso: borradores entregados por target (se informa el más adelantado)."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self._by_target: Dict[int, int] = {}
 
-    if enviados_ids and mark_as_sent:
-        mark_sent(DB_FILE, enviados_ids)
+    def add(self, dest: int, n: int):
+        self._by_target[dest] = self._by_target.get(dest, 0) + n
 
-    return publicados, fallidos, posted_by_target
+    @property
+    def done(self) -> int:
+        return min(self.total, max(self._by_target.values(), default=0))
 
-async def publicar(context: ContextTypes.DEFAULT_TYPE, *, targets: List[int], mark_as_sent: bool):
-    """Envía la cola completa EXCLUYENDO los bloqueados (SCHEDULED_LOCK)."""
-    all_rows = get_unsent_drafts(DB_FILE)  # [(message_id, text, raw_json)]
-    if not all_rows:
-        return 0, 0, {t: [] for t in targets}
-    rows = [(m, t, r) for (m, t, r) in all_rows if m not in SCHEDULED_LOCK]
-    if not rows:
-        return 0, 0, {t: [] for t in targets}
-    return await _publicar_rows(context, rows=rows, targets=targets, mark_as_sent=mark_as_sent)
+async def _publicar_en_target(context: ContextTypes.DEFAULT_TYPE, dest: int,
+                              source: Callable[[], AsyncIterator[Draft]],
+                              journal: Optional[_DeliveryJournal],
+                              progress: Optional[Progress] = None) -> Tuple[List[int], Set[int], List[Tuple[int, Optional[int]]]]:
+    """
+    Worker de un target: recorre `source()` y envía en orden estricto.
+    Devuelve (ids_vistos, ids_entregados, [(draft_id, posted_id)] de lo enviado en esta tanda).
+    Con `journal`, salta lo que ya consta entregado en este target (reanudación tras un reinicio).
+    """
+    seen: List[int] = []
+    ok_ids: Set[int] = set()
+    sent: List[Tuple[int, Optional[int]]] = []
+    # la tanda entera tiene el target para sí: otra publicación solapada espera su turno
+    async with OUTBOX.lane(dest):
+        done = await get_delivered_pending(DB_FILE, dest) if journal is not None else set()
+
+        async def _stream() -> AsyncIterator[Draft]:
+            async for d in source():
+                seen.append(d.message_id)
+                if d.message_id in done:
+                    ok_ids.add(d.message_id)
+                    if progress is not None:
+                        progress.add(dest, 1)
+                    continue
+                yield d
+
+        if done:
+            logger.info(f"Target {dest}: {len(done)} ya entregados antes; se reanuda desde ahí.")
+        started: Optional[float] = None
+        units = 0
+        async for kind, groups, data in _build_units(_stream()):
+            if started is None:
+                started = time.monotonic()
+            got = await _enviar_unidad(context, dest, kind, groups, data)
+            units += 1
+            ok_ids.update(mid for mid, _pid in got)
+            sent.extend(got)
+            if journal is not None and got:
+                await journal.add(dest, got)
+            if progress is not None:
+                progress.add(dest, sum(len(g) for g in groups))
+        if journal is not None:
+            await journal.flush()  # lo entregado consta en el diario antes de soltar el target
+        if started is not None and units >= THROUGHPUT_MIN_SAMPLE:
+            # una tanda corta cabe en la ráfaga del bucket y solo mide ida y vuelta:
+            # se normaliza con el ritmo que el limitador habría impuesto
+            elapsed = max(time.monotonic() - started, LIMITER.chat_floor(units))
+            await record_throughput(DB_FILE, dest, elapsed / units)
+    return seen, ok_ids, sent
+
+# ========= estimación de duración =========
+THROUGHPUT_MIN_SAMPLE = 5  # llamadas mínimas para que una tanda cuente como medición
+
+async def count_schedule_units(schedule_id: int) -> int:
+    """Llamadas a la API que costará la programación: encuestas + álbumes + lotes de copy_messages."""
+    n = 0
+    async for _unit in _build_units(iter_unsent_drafts(DB_FILE, schedule_id=schedule_id)):
+        n += 1
+    return n
+
+async def estimate_seconds(units: int, targets: List[int]) -> Optional[float]:
+    """
+    Segundos que tardarían `units` llamadas (ver count_schedule_units) en `targets` (en paralelo:
+    manda el más lento), según la velocidad medida en tandas anteriores y nunca por debajo del
+    ritmo que impone el limitador por chat pasada la ráfaga. None si aún no hay historial.
+    """
+    if units <= 0 or not targets:
+        return 0.0
+    rates = await get_throughput(DB_FILE, targets)
+    if not rates:
+        return None
+    return max(units * max(rates.values()), LIMITER.chat_floor(units))
+
+async def _publicar_stream(context: ContextTypes.DEFAULT_TYPE, *, ids: List[int],
+                           targets: List[int], mark_as_sent: bool, prio: int,
+                           progress: Optional[Progress] = None,
+                           schedule_id: Optional[int] = None) -> Tuple[int, int, Dict[int, List[int]], Optional[int]]:
+    """
+    Publica los borradores `ids` en todos los targets: un worker por target, en paralelo
+    entre sí, cada uno con su propio recorrido paginado de la cola (memoria acotada).
+    Foto fija del conjunto: lo que se reserve (/programar, /goteo) o se cancele mientras se
+    publica no cambia qué borradores reciben los targets; todos ven los mismos. Mientras dura,
+    esos ids quedan en vuelo en el índice: no se pueden programar ni cancelar.
+    Con mark_as_sent, cada entrega se anota en el diario `deliveries` sobre la marcha, de modo
+    que un /enviar o una programación relanzados tras un reinicio continúan donde se quedaron.
+    `prio` es la prioridad de la tanda en el despachador de salida (outbox.py).
+    Devuelve (publicados, fallidos, posted_by_target, run_id); run_id es la tanda para /retirar
+    (None si no se anotó nada, p. ej. en preview).
+    """
+    source = lambda: iter_unsent_drafts(DB_FILE, ids=ids, include_deleted=True)
+    journal = _DeliveryJournal(schedule_id) if mark_as_sent else None
+    idx = pending_index(DB_FILE)
+    idx.hold(ids)
+    try:
+        try:
+            with priority(prio):
+                results = await asyncio.gather(*(_publicar_en_target(context, dest, source, journal, progress) for dest in targets))
+        finally:
+            if journal is not None:
+                await journal.flush()
+
+        posted_by_target: Dict[int, List[int]] = {}
+        seen: Set[int] = set()
+        delivered: Set[int] = set()
+        for dest, (seen_t, ok_ids, sent) in zip(targets, results):
+            posted_by_target[dest] = [pid for _mid, pid in sent if pid]
+            seen.update(seen_t)
+            delivered.update(ok_ids)
+
+        # Un borrador cuenta como publicado si llegó al menos a un target
+        enviados_ids = sorted(delivered)
+        publicados = len(enviados_ids)
+        fallidos = len(seen - delivered)
+
+        if enviados_ids and mark_as_sent:
+            await mark_sent(DB_FILE, enviados_ids)
+    finally:
+        idx.unhold(ids)
+
+    return publicados, fallidos, posted_by_target, (journal.run_id if journal is not None else None)
+
+async def publicar(context: ContextTypes.DEFAULT_TYPE, *, targets: List[int], mark_as_sent: bool,
+                   prio: int = MANUAL, progress: Optional[Progress] = None):
+    """Envía la cola completa EXCLUYENDO los reservados por una programación."""
+    return await _publicar_stream(context, ids=pending_index(DB_FILE).unscheduled_ids(), targets=targets,
+                                  mark_as_sent=mark_as_sent, prio=prio, progress=progress)
 
 async def publicar_ids(context: ContextTypes.DEFAULT_TYPE, *, ids: List[int],
-                       targets: List[int], mark_as_sent: bool):
-    # Query puntual sin duplicar lógica del módulo database
-    import sqlite3
+                       targets: List[int], mark_as_sent: bool, prio: int = MANUAL,
+                       schedule_id: Optional[int] = None):
     if not ids:
-        return 0, 0, {t: [] for t in targets}
-    placeholders = ",".join("?" for _ in ids)
-    sql = f"SELECT message_id, snippet, raw_json FROM drafts WHERE sent=0 AND deleted=0 AND message_id IN ({placeholders}) ORDER BY message_id ASC"
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    rows = list(cur.execute(sql, ids).fetchall())
-    con.close()
-    if not rows:
-        return 0, 0, {t: [] for t in targets}
-    return await _publicar_rows(context, rows=rows, targets=targets, mark_as_sent=mark_as_sent)
-
-async def publicar_todo_activos(context: ContextTypes.DEFAULT_TYPE):
-    pubs, fails, _ = await publicar(context, targets=get_active_targets(), mark_as_sent=True)
-    return pubs, fails
+        return 0, 0, {t: [] for t in targets}, None
+    return await _publicar_stream(context, ids=list(ids), targets=targets, mark_as_sent=mark_as_sent,
+                                  prio=prio, schedule_id=schedule_id)
+
+async def publicar_programacion(context: ContextTypes.DEFAULT_TYPE, *, schedule_id: int,
+                                targets: List[int], mark_as_sent: bool, prio: int = SCHEDULED):
+    """Envía lo reservado por la programación `schedule_id`."""
+    ids = pending_index(DB_FILE).scheduled_ids(schedule_id)
+    return await _publicar_stream(context, ids=ids, targets=targets, mark_as_sent=mark_as_sent,
+                                  prio=prio, schedule_id=schedule_id)
+
+# ========= preview incremental =========
+async def plan_preview(full: bool = False) -> Tuple[Dict[int, int], List[int]]:
+    """
+    Qué hay que mandar a PREVIEW: ({draft_id: versión}, copias viejas a borrar antes).
+    Normalmente solo lo nuevo o editado desde la última preview (un álbum con un miembro
+    cambiado va entero); con `full`, toda la cola y todo lo que hubiera en PREVIEW.
+    """
+    state = await preview_state(DB_FILE)
+    if full:
+        return {mid: v for (mid, v, _pv, _p) in state}, await list_preview_copies(DB_FILE)
+    stale = {mid for (mid, v, pv, _p) in state if pv != v}
+    if stale:
+        for _first, _snip, ids in pending_index(DB_FILE).entries(unscheduled=True):
+            if len(ids) > 1 and stale.intersection(ids):
+                stale.update(ids)
+    versions = {mid: v for (mid, v, _pv, _p) in state if mid in stale}
+    old = [p for (mid, _v, _pv, p) in state if mid in stale and p]
+    return versions, old
+
+async def publicar_preview(context: ContextTypes.DEFAULT_TYPE, *, versions: Dict[int, int],
+                           progress: Optional[Progress] = None) -> Tuple[int, int]:
+    """Manda a PREVIEW los borradores de `versions` y anota cada copia en preview_copies."""
+    if not versions:
+        return 0, 0
+    ids = sorted(versions)
+    source = lambda: iter_unsent_drafts(DB_FILE, ids=ids)
+    with priority(PREVIEW):
+        seen, ok_ids, sent = await _publicar_en_target(context, PREVIEW_CHAT_ID, source, None, progress)
+    await record_preview_copies(DB_FILE, [(mid, pid, versions[mid]) for mid, pid in sent])
+    return len(ok_ids), len(set(seen) - ok_ids)
+
+async def publicar_todo_activos(context: ContextTypes.DEFAULT_TYPE, progress: Optional[Progress] = None):
+    pubs, fails, _posted, run_id = await publicar(context, targets=get_active_targets(), mark_as_sent=True, progress=progress)
+    return pubs, fails, run_id
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Limitador de envíos basado en token buckets.
+# Un bucket global (límite del bot) + un bucket por chat (límite por canal).
+# Quien reparte los turnos es outbox.py (el despachador de salida); aquí solo se cuentan tokens.
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, Optional
+
+from telegram.error import RetryAfter
+
+from config import RATE_GLOBAL_PER_SEC, RATE_CHAT_PER_MIN
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """`rate` tokens por segundo, acumulando como máximo `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()  # los que esperan turno salen en orden FIFO
+
+    def _refill(self, now: float) -> None:
+        if now < self._blocked_until:
+            return
+        start = max(self._stamp, self._blocked_until)
+        self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._stamp = now
+
+    def delay(self) -> float:
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now + max(0.0, 1.0 - self._tokens) / self.rate
+        if self._tokens >= 1.0:
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+    def available(self) -> float:
+        """Tokens disponibles ahora mismo (0 mientras dura un congelamiento)."""
+        now = time.monotonic()
+        self._refill(now)
+        return 0.0 if now < self._blocked_until else self._tokens
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                wait = self.delay()
+                if wait <= 0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep(wait)
+
+    def drain(self, seconds: float) -> None:
+        """Vacía el bucket y lo congela `seconds` segundos (para todos los que lo usan)."""
+        now = time.monotonic()
+        self._tokens = 0.0
+        self._stamp = now
+        self._blocked_until = max(self._blocked_until, now + max(0.0, seconds))
+
+class RateLimiter:
+    """Bucket global del bot + un bucket por chat, creado bajo demanda."""
+
+    def __init__(self, per_second: float, per_chat_per_minute: float):
+        self._global = TokenBucket(per_second, per_second)
+        self._chat_rate = per_chat_per_minute / 60.0
+        self._chat_capacity = per_chat_per_minute
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            b = TokenBucket(self._chat_rate, self._chat_capacity)
+            self._chats[chat_id] = b
+        return b
+
+    def chat_floor(self, calls: int) -> float:
+        """
+        Segundos mínimos que el bucket de un chat impone a `calls` llamadas seguidas: las
+        primeras `capacity` salen de la ráfaga inicial y el resto al ritmo del bucket.
+        """
+        return max(0.0, calls - self._chat_capacity) / self._chat_rate
+
+    async def acquire_chat(self, chat_id: int) -> None:
+        await self.bucket(chat_id).acquire()
+
+    async def acquire_global(self) -> None:
+        await self._global.acquire()
+
+    def penalize(self, chat_id: Optional[int], seconds: float) -> None:
+        """Aplica un RetryAfter al bucket afectado; todos los emisores de ese chat esperan."""
+        if chat_id is None:
+            self._global.drain(seconds)
+        else:
+            self.bucket(chat_id).drain(seconds)
+
+LIMITER = RateLimiter(RATE_GLOBAL_PER_SEC, RATE_CHAT_PER_MIN)
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    wait = getattr(e, "retry_after", None)
+    if wait is None:
+        m = re.search(r"Retry in (\d+)", str(e))
+        wait = int(m.group(1)) if m else 3
+    if hasattr(wait, "total_seconds"):
+        wait = wait.total_seconds()
+    return float(wait)
@@ -1,147 +1,440 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
 
-from telegram.ext import ContextTypes
-from config import TZ, TZNAME, SOURCE_CHAT_ID
-from core_utils import human_eta
-from publisher import publicar_ids, get_active_targets, STATS, SCHEDULED_LOCK
+from telegram.ext import Application, ContextTypes, JobQueue
+from config import TZ, TZNAME, DB_FILE, SCHEDULE_CATCHUP, SCHEDULE_CATCHUP_GRACE_MIN
+from core_utils import human_eta, human_duration, send_text
+from database import (
+    Schedule, reserve_drafts, release_schedule, create_schedule, update_schedule,
+    active_schedules, due_schedules, next_schedule_ts, release_orphan_reservations, pending_index,
+)
+from drip import CURVES, DEFAULT_CURVE, parse_curve, slot_ts
+from outbox import SCHEDULED
+from publisher import publicar_programacion, publicar_ids, get_active_targets, estimate_seconds, count_schedule_units, STATS
 
 logger = logging.getLogger(__name__)
 
-# REGISTRO EN MEMORIA: {pid: {"when": datetime, "ids": [...], "job": Job}}
-SCHEDULES: Dict[int, Dict] = {}
-SCHED_SEQ: int = 0
+# Las programaciones viven en la tabla `schedules` (y sus IDs en drafts.schedule_id).
+# Un único job del JobQueue ("timer") se arma para la próxima que venza; al dispararse
+# ejecuta todas las vencidas y se vuelve a armar. Así el arranque no depende de cuántas haya.
+TIMER_NAME = "prog:timer"
+_TICK_LOCK = asyncio.Lock()
+TICK_RETRY = 60  # segundos: reintento de una programación (o del rearme) que falló
 
-async def schedule_ids(context: ContextTypes.DEFAULT_TYPE, when_dt: datetime, ids: List[int]):
-    """Programa el envío de esos IDs exactos. Bloquea esos IDs hasta que se ejecute."""
-    if not ids:
-        await context.bot.send_message(SOURCE_CHAT_ID, "📭 No hay borradores para programar.")
+def _dt(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, tz=TZ)
+
+async def list_schedules() -> List[Tuple[int, datetime, str, int]]:
+    """[(pid, próxima ejecución, status, mensajes pendientes)] ordenado por fecha."""
+    return [(s.id, _dt(s.when_ts), s.status, s.remaining) for s in await active_schedules(DB_FILE)]
+
+def _arm(job_queue: JobQueue, when_ts: Optional[int]):
+    for job in job_queue.get_jobs_by_name(TIMER_NAME):
+        job.schedule_removal()
+    if when_ts is None:
         return
+    job_queue.run_once(_tick, when=max(0.0, when_ts - time.time()), name=TIMER_NAME)
+
+async def _rearm(job_queue: JobQueue):
+    _arm(job_queue, await next_schedule_ts(DB_FILE))
 
-    # bloquear
-    SCHEDULED_LOCK.update(ids)
+async def _notify(bot, text: str):
+    """Aviso en BORRADOR que nunca tumba al timer: si falla, solo queda en el log."""
+    try:
+        await send_text(bot, text)
+    except Exception as e:
+        logger.warning(f"No pude avisar en BORRADOR ({text[:40]}…) → {e}")
+
+async def _run_schedule(ctx: ContextTypes.DEFAULT_TYPE, pid: int):
+    await update_schedule(DB_FILE, pid, status="running")
+    status = "done"
+    try:
+        pubs, fails, _posted, run_id = await publicar_programacion(ctx, schedule_id=pid, targets=get_active_targets(), mark_as_sent=True)
+        report = f"⏱️ Programación #{pid} ejecutada. Publicados {pubs}."
+        if run_id:
+            report += f" (tanda #{run_id})"
+        extra = []
+        if STATS["cancelados"]:
+            extra.append(f"Cancelados: {STATS['cancelados']}")
+        if STATS["eliminados"]:
+            extra.append(f"Eliminados: {STATS['eliminados']}")
+        if fails:
+            extra.append(f"Fallidos: {fails}")
+        if extra:
+            report += " " + " · ".join(extra) + "."
+        STATS["cancelados"] = 0
+        STATS["eliminados"] = 0
+    except Exception as e:
+        status = "failed"
+        logger.exception(f"Error en job programado: {e}")
+        report = "❌ Error ejecutando la programación (revisa logs)."
+    finally:
+        # lo que no salió vuelve a la cola normal
+        await release_schedule(DB_FILE, pid)
+        await update_schedule(DB_FILE, pid, status=status)
+    # el aviso va aparte: si falla, la publicación no pasa a 'failed'
+    await _notify(ctx.bot, report)
 
-    # registrar
-    global SCHED_SEQ
-    SCHED_SEQ += 1
-    pid = SCHED_SEQ
-    rec = {"when": when_dt, "ids": list(ids), "job": None}
-    SCHEDULES[pid] = rec
+def _drip_units(pid: int) -> List[List[int]]:
+    """Envíos pendientes del goteo `pid`, en orden (un álbum = un envío)."""
+    idx = pending_index(DB_FILE)
+    return [ids for (first, _snip, ids) in idx.entries() if idx.schedule_of(first) == pid]
 
-    async def job(ctx: ContextTypes.DEFAULT_TYPE):
+async def _run_drip_step(ctx: ContextTypes.DEFAULT_TYPE, s: Schedule):
+    """Publica el siguiente envío del goteo y deja `when_ts` en el hueco siguiente."""
+    units = _drip_units(s.id)
+    done = s.done
+    if units and done < s.total:
+        await update_schedule(DB_FILE, s.id, status="running")
         try:
-            pubs, fails, _posted = await publicar_ids(ctx, ids=ids, targets=get_active_targets(), mark_as_sent=True)
-            msg2 = f"⏱️ Programación ejecutada. Publicados {pubs}."
-            extra = []
-            if STATS["cancelados"]:
-                extra.append(f"Cancelados: {STATS['cancelados']}")
-            if STATS["eliminados"]:
-                extra.append(f"Eliminados: {STATS['eliminados']}")
+            _pubs, fails, _posted, _run = await publicar_ids(ctx, ids=units[0], targets=get_active_targets(),
+                                                             mark_as_sent=True, prio=SCHEDULED, schedule_id=s.id)
             if fails:
-                extra.append(f"Fallidos: {fails}")
-            if extra:
-                msg2 += " " + " · ".join(extra) + "."
-            await ctx.bot.send_message(SOURCE_CHAT_ID, msg2)
-            STATS["cancelados"] = 0
-            STATS["eliminados"] = 0
+                await _notify(ctx.bot, f"⚠️ Goteo #{s.id}: falló un envío (ids {units[0][0]}…); se reintenta en el próximo hueco.")
         except Exception as e:
-            logger.exception(f"Error en job programado: {e}")
-            await ctx.bot.send_message(SOURCE_CHAT_ID, "❌ Error ejecutando la programación (revisa logs).")
+            logger.exception(f"Error en goteo #{s.id}: {e}")
+        done += 1
+        units = _drip_units(s.id)
+    if units and done < s.total:
+        nxt = slot_ts(s.start_ts, s.end_ts, done, s.total, s.curve)
+        await update_schedule(DB_FILE, s.id, status="pending", done=done, when_ts=nxt)
+        return
+    # terminado: lo que quedó (fallidos) vuelve a la cola normal
+    left = await release_schedule(DB_FILE, s.id)
+    await update_schedule(DB_FILE, s.id, status="done", done=done)
+    msg = f"💧 Goteo #{s.id} terminado: {done}/{s.total} envíos."
+    if left:
+        msg += f" {len(left)} mensajes vuelven a la cola."
+    await _notify(ctx.bot, msg)
+
+async def _tick(ctx: ContextTypes.DEFAULT_TYPE):
+    # Un solo timer para todas: un error en una programación no puede dejarlo sin rearmar.
+    async with _TICK_LOCK:
+        try:
+            for s in await due_schedules(DB_FILE, int(time.time())):
+                try:
+                    if s.kind == "drip":
+                        await _run_drip_step(ctx, s)
+                    else:
+                        await _run_schedule(ctx, s.id)
+                except Exception as e:
+                    logger.exception(f"Error en programación #{s.id}; se reintenta en {TICK_RETRY}s: {e}")
+                    try:
+                        await update_schedule(DB_FILE, s.id, status="pending", when_ts=int(time.time()) + TICK_RETRY)
+                    except Exception:
+                        logger.exception(f"No pude reprogramar #{s.id}")
         finally:
-            for i in ids:
-                SCHEDULED_LOCK.discard(i)
-            SCHEDULES.pop(pid, None)
+            try:
+                await _rearm(ctx.job_queue)
+            except Exception as e:
+                logger.exception(f"No pude rearmar el timer; reintento en {TICK_RETRY}s: {e}")
+                _arm(ctx.job_queue, int(time.time()) + TICK_RETRY)
 
-    now = datetime.now(tz=TZ)
-    seconds = max(0, int((when_dt - now).total_seconds()))
+def _catchup_allows(late_s: float) -> bool:
+    if SCHEDULE_CATCHUP == "skip":
+        return False
+    if SCHEDULE_CATCHUP == "grace":
+        return late_s <= SCHEDULE_CATCHUP_GRACE_MIN * 60
+    return True  # "run"
+
+async def _recover_drip(s: Schedule, now: int) -> Optional[str]:
+    """
+    Goteo que estuvo parado con el bot apagado. La política se decide por el fin de la ventana,
+    no por el hueco que tocaba: si la ventana sigue abierta, lo que queda se reparte de nuevo
+    entre ahora y el fin; si ya cerró y la política deja recuperarlo, se reparte en una ventana
+    desde ahora tan larga como la que faltaba (mismo ritmo, sin ráfagas).
+    Devuelve 'resumed' | 'caught_up' | 'skipped', o None si no hay nada que hacer.
+    """
+    if s.status == "pending" and s.when_ts > now:
+        return None
+    if s.end_ts > now:
+        start, end, outcome = now, s.end_ts, "resumed"
+    elif _catchup_allows(now - s.end_ts):
+        start, outcome = now, "caught_up"
+        end = now + max(0, s.end_ts - min(s.when_ts, s.end_ts))
+    else:
+        await release_schedule(DB_FILE, s.id)
+        await update_schedule(DB_FILE, s.id, status="skipped")
+        return "skipped"
+    units = len(_drip_units(s.id))
+    await update_schedule(DB_FILE, s.id, status="pending", start_ts=start, end_ts=end,
+                          total=units, done=0, when_ts=slot_ts(start, end, 0, units, s.curve))
+    return outcome
+
+async def recover_schedules(app: Application):
+    """
+    Al arrancar: relee las programaciones vivas (una consulta), aplica la política de
+    recuperación a las que vencieron con el bot apagado y arma el timer.
+    Las que estaban a medias ('running') se reanudan: el diario de entregas evita duplicados.
+    """
+    if not app.job_queue:
+        logger.warning("Sin JobQueue: las programaciones guardadas no se ejecutarán.")
+        return
+    now = time.time()
+    resumed, caught_up, skipped = [], [], []
+    for s in await active_schedules(DB_FILE):
+        pid = s.id
+        if s.kind == "drip":
+            outcome = await _recover_drip(s, int(now))
+            if outcome:
+                {"resumed": resumed, "caught_up": caught_up, "skipped": skipped}[outcome].append(pid)
+        elif s.status == "running":
+            await update_schedule(DB_FILE, pid, status="pending", when_ts=min(s.when_ts, int(now)))
+            resumed.append(pid)
+        elif s.when_ts <= now:
+            if _catchup_allows(now - s.when_ts):
+                caught_up.append(pid)
+            else:
+                await release_schedule(DB_FILE, pid)
+                await update_schedule(DB_FILE, pid, status="skipped")
+                skipped.append(pid)
+    # reservas sin programación viva (cancelaciones a medias, bases antiguas)
+    await release_orphan_reservations(DB_FILE)
+    await _rearm(app.job_queue)
+
+    lines = []
+    if resumed:
+        lines.append("🔁 Reanudando programaciones interrumpidas: " + ", ".join(f"#{p}" for p in resumed))
+    if caught_up:
+        lines.append("⏱️ Ejecutando programaciones vencidas mientras estaba apagado: " + ", ".join(f"#{p}" for p in caught_up))
+    if skipped:
+        lines.append("⏭️ Omitidas por vencidas (vuelven a la cola): " + ", ".join(f"#{p}" for p in skipped))
+    if lines:
+        await send_text(app.bot, "\n".join(lines))
+
+# Cómo se alinea la tanda con la hora pedida
+ALIGNS = {
+    "inicio": "inicio", "empezar": "inicio",   # empieza a la hora (por defecto)
+    "llegar": "llegar", "fin": "llegar",       # el último mensaje llega a la hora
+    "centrar": "centrar", "centro": "centrar", # la tanda queda centrada en la hora
+}
+
+def _aligned_start(deadline_ts: int, est: Optional[float], align: str) -> int:
+    if not est or align == "inicio":
+        return deadline_ts
+    lead = est if align == "llegar" else est / 2
+    return max(int(time.time()), int(deadline_ts - lead))
+
+def _estimate_text(est: Optional[float]) -> str:
+    return f"{human_duration(est)} de envío" if est is not None else "duración sin historial aún"
+
+async def schedule_ids(context: ContextTypes.DEFAULT_TYPE, when_dt: datetime, ids: List[int],
+                       align: str = "inicio"):
+    """
+    Programa el envío de esos IDs exactos. Los reserva en la DB hasta que se ejecute.
+    Con align='llegar' o 'centrar', adelanta el arranque según la velocidad medida de los targets.
+    """
+    if not ids:
+        await send_text(context.bot, "📭 No hay borradores para programar.")
+        return
     if not context.job_queue:
-        await context.bot.send_message(
-            SOURCE_CHAT_ID,
+        await send_text(
+            context.bot,
             "❌ No pude programar. Falta JobQueue. Asegúrate de usar `python-telegram-bot[job-queue]`.",
             parse_mode="Markdown",
         )
-        for i in ids:
-            SCHEDULED_LOCK.discard(i)
-        SCHEDULES.pop(pid, None)
         return
 
-    rec["job"] = context.job_queue.run_once(job, when=seconds)
+    # registrar y reservar (solo los que sigan libres)
+    deadline_ts = int(when_dt.timestamp())
+    pid = await create_schedule(DB_FILE, deadline_ts, deadline_ts=deadline_ts, align=align)
+    ids = await reserve_drafts(DB_FILE, ids, pid)
+    if not ids:
+        await update_schedule(DB_FILE, pid, status="cancelled")
+        await send_text(context.bot, "📭 No hay borradores para programar.")
+        return
+    est = await estimate_seconds(await count_schedule_units(pid), get_active_targets())
+    start_ts = _aligned_start(deadline_ts, est, align)
+    await update_schedule(DB_FILE, pid, total=len(ids), when_ts=start_ts)
+    await _rearm(context.job_queue)
 
     eta = human_eta(when_dt)
-    await context.bot.send_message(
-        SOURCE_CHAT_ID,
-        f"🗓️ Programado para {when_dt.astimezone(TZ):%Y-%m-%d %H:%M} ({TZNAME}) — {eta}.  (id prog: {pid})"
+    msg = (
+        f"🗓️ Programado para {when_dt.astimezone(TZ):%Y-%m-%d %H:%M} ({TZNAME}) — {eta} — "
+        f"{_estimate_text(est)}.  (id prog: {pid})"
     )
+    if start_ts != deadline_ts:
+        verb = "llegue el último" if align == "llegar" else "quede centrado"
+        msg += f"\n⏩ Empieza a las {_dt(start_ts):%H:%M} para que {verb} a la hora."
+    await send_text(context.bot, msg)
 
 async def cmd_programar(context: ContextTypes.DEFAULT_TYPE, when_str: str):
-    from config import DB_FILE
-    from database import list_drafts
+    """`YYYY-MM-DD HH:MM [inicio|llegar|centrar]`"""
+    parts = (when_str or "").split()
+    align = ALIGNS.get(parts[2].lower()) if len(parts) == 3 else "inicio"
     try:
-        when = datetime.strptime(when_str, "%Y-%m-%d %H:%M").replace(tzinfo=TZ)
+        if len(parts) not in (2, 3) or align is None:
+            raise ValueError(when_str)
+        when = datetime.strptime(f"{parts[0]} {parts[1]}", "%Y-%m-%d %H:%M").replace(tzinfo=TZ)
     except Exception:
-        await context.bot.send_message(
-            SOURCE_CHAT_ID,
-            "❌ Formato inválido. Usa: `/programar YYYY-MM-DD HH:MM` (24h: 00:00–23:59, sin '(24h)' ni AM/PM).",
+        await send_text(
+            context.bot,
+            "❌ Formato inválido. Usa: `/programar YYYY-MM-DD HH:MM [llegar|centrar]` (24h: 00:00–23:59, sin '(24h)' ni AM/PM).",
             parse_mode="Markdown",
         )
         return
 
-    ids = [did for (did, _snip) in list_drafts(DB_FILE)]
+    ids = pending_index(DB_FILE).unscheduled_ids()
     if not ids:
-        await context.bot.send_message(SOURCE_CHAT_ID, "📭 No hay borradores para programar.")
+        await send_text(context.bot, "📭 No hay borradores para programar.")
         return
-    await schedule_ids(context, when, ids)
+    await schedule_ids(context, when, ids, align)
 
 async def cmd_programados(context: ContextTypes.DEFAULT_TYPE):
-    if not SCHEDULES:
-        await context.bot.send_message(SOURCE_CHAT_ID, "📭 No hay programaciones pendientes.")
+    scheds = await active_schedules(DB_FILE)
+    if not scheds:
+        await send_text(context.bot, "📭 No hay programaciones pendientes.")
         return
-    from datetime import datetime as _dt
-    now = _dt.now(tz=TZ)
+    now = datetime.now(tz=TZ)
     lines = ["🗒 Programaciones pendientes:"]
-    for pid, rec in sorted(SCHEDULES.items()):
-        when = rec["when"]
-        ids = rec["ids"]
-        eta = human_eta(when, now)
-        lines.append(f"• #{pid} — {when.astimezone(TZ):%Y-%m-%d %H:%M} ({TZNAME}) — {eta} — {len(ids)} mensajes")
-    await context.bot.send_message(SOURCE_CHAT_ID, "\n".join(lines))
+    for s in scheds:
+        when = _dt(s.when_ts)
+        if s.kind == "drip":
+            start, end = _dt(s.start_ts), _dt(s.end_ts)
+            nxt = "enviando" if s.status == "running" else f"próximo {human_eta(when, now)}"
+            lines.append(
+                f"• #{s.id} — 💧 goteo {start:%Y-%m-%d %H:%M}→{end:%H:%M} ({TZNAME}, {s.curve or DEFAULT_CURVE}) — "
+                f"{s.done}/{s.total} envíos — {nxt} — termina {human_eta(end, now)}"
+            )
+            continue
+        deadline = _dt(s.deadline_ts or s.when_ts)
+        eta = "en curso" if s.status == "running" else human_eta(deadline, now)
+        est = _estimate_text(await estimate_seconds(await count_schedule_units(s.id), get_active_targets()))
+        line = f"• #{s.id} — {deadline:%Y-%m-%d %H:%M} ({TZNAME}) — {eta} — {est} — {s.remaining} mensajes"
+        if s.when_ts != s.deadline_ts and s.deadline_ts and s.status == "pending":
+            line += f" (empieza {when:%H:%M}, {s.align})"
+        lines.append(line)
+    await send_text(context.bot, "\n".join(lines))
 
 async def cmd_desprogramar(context: ContextTypes.DEFAULT_TYPE, arg: str):
     v = (arg or "").strip().lower()
     if v in ("all", "todos"):
-        count = 0
-        for pid, rec in list(SCHEDULES.items()):
-            job = rec.get("job")
-            if job:
-                try:
-                    job.schedule_removal()
-                except Exception:
-                    pass
-            for i in rec.get("ids", []):
-                SCHEDULED_LOCK.discard(i)
-            SCHEDULES.pop(pid, None)
-            count += 1
-        await context.bot.send_message(SOURCE_CHAT_ID, f"❌ Canceladas {count} programaciones.")
+        scheds = [s.id for s in await active_schedules(DB_FILE) if s.status == "pending"]
+        for pid in scheds:
+            await update_schedule(DB_FILE, pid, status="cancelled")
+        # libera toda reserva, incluidas las que quedaron huérfanas de un reinicio
+        await release_orphan_reservations(DB_FILE)
+        if context.job_queue:
+            await _rearm(context.job_queue)
+        await send_text(context.bot, f"❌ Canceladas {len(scheds)} programaciones.")
         return
 
     if v.isdigit():
         pid = int(v)
-        rec = SCHEDULES.get(pid)
-        if not rec:
-            await context.bot.send_message(SOURCE_CHAT_ID, f"No existe la programación #{pid}.")
+        status = next((s.status for s in await active_schedules(DB_FILE) if s.id == pid), None)
+        if status is None:
+            await send_text(context.bot, f"No existe la programación #{pid}.")
             return
-        job = rec.get("job")
-        if job:
-            try:
-                job.schedule_removal()
-            except Exception:
-                pass
-        for i in rec.get("ids", []):
-            SCHEDULED_LOCK.discard(i)
-        SCHEDULES.pop(pid, None)
-        await context.bot.send_message(SOURCE_CHAT_ID, f"❌ Cancelada la programación #{pid}.")
+        if status == "running":
+            await send_text(context.bot, f"La programación #{pid} ya se está enviando.")
+            return
+        await update_schedule(DB_FILE, pid, status="cancelled")
+        await release_schedule(DB_FILE, pid)
+        if context.job_queue:
+            await _rearm(context.job_queue)
+        await send_text(context.bot, f"❌ Cancelada la programación #{pid}.")
+        return
+
+    await send_text(context.bot, "Usa: /desprogramar <id|all>")
+
+# ========= goteo =========
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_TIME_RE = re.compile(r"^\d{1,2}:\d{2}$")
+
+def _read_dt(tokens: List[str], i: int, base: date) -> Tuple[Optional[datetime], int, bool]:
+    """Lee 'YYYY-MM-DD HH:MM' o 'HH:MM' (sobre `base`). Devuelve (dt, siguiente índice, solo_hora)."""
+    if i < len(tokens) and _DATE_RE.match(tokens[i]) and i + 1 < len(tokens) and _TIME_RE.match(tokens[i + 1]):
+        try:
+            dt = datetime.strptime(f"{tokens[i]} {tokens[i + 1]}", "%Y-%m-%d %H:%M").replace(tzinfo=TZ)
+        except ValueError:
+            return None, i, False
+        return dt, i + 2, False
+    if i < len(tokens) and _TIME_RE.match(tokens[i]):
+        try:
+            t = datetime.strptime(tokens[i], "%H:%M").time()
+        except ValueError:
+            return None, i, False
+        return datetime.combine(base, t, tzinfo=TZ), i + 1, True
+    return None, i, False
+
+def parse_goteo(arg: str, now: datetime) -> Optional[Tuple[datetime, datetime, str, Optional[int]]]:
+    """
+    '<inicio> <fin> [curva] [cantidad]' -> (inicio, fin, curva, cantidad|None).
+    Inicio/fin: 'HH:MM' (hoy; si la ventana ya pasó, mañana) o 'YYYY-MM-DD HH:MM'.
+    """
+    tokens = (arg or "").split()
+    start, i, start_time_only = _read_dt(tokens, 0, now.date())
+    if start is None:
+        return None
+    end, i, end_time_only = _read_dt(tokens, i, start.date())
+    if end is None:
+        return None
+    if end_time_only and end <= start:
+        end += timedelta(days=1)  # 22:00 02:00 cruza la medianoche
+    if start_time_only and end <= now:
+        start += timedelta(days=1)
+        end += timedelta(days=1)
+    if end <= start or end <= now:
+        return None
+    curve, count = DEFAULT_CURVE, None
+    for tok in tokens[i:]:
+        if tok.isdigit() and count is None:
+            count = int(tok)
+            continue
+        spec = parse_curve(tok)
+        if spec is None:
+            return None
+        curve = spec
+    return max(start, now), end, curve, count
+
+async def cmd_goteo(context: ContextTypes.DEFAULT_TYPE, arg: str):
+    """Reparte los borradores (o los N primeros) a lo largo de una ventana, según una curva."""
+    usage = (
+        "Usa: `/goteo <inicio> <fin> [curva] [cantidad]`\n"
+        "• inicio/fin: `HH:MM` o `YYYY-MM-DD HH:MM` (24h)\n"
+        f"• curva: {' | '.join(CURVES)} | pesos como `1,3,1`\n"
+        "Ej.: `/goteo 08:00 12:00 s 120`"
+    )
+    now = datetime.now(tz=TZ)
+    parsed = parse_goteo(arg, now)
+    if not parsed:
+        await send_text(context.bot, usage, parse_mode="Markdown")
+        return
+    start, end, curve, count = parsed
+    if not context.job_queue:
+        await send_text(
+            context.bot,
+            "❌ No pude programar. Falta JobQueue. Asegúrate de usar `python-telegram-bot[job-queue]`.",
+            parse_mode="Markdown",
+        )
+        return
+
+    units = [ids for (_first, _snip, ids) in pending_index(DB_FILE).entries(unscheduled=True)]
+    if count is not None:
+        units = units[:count]
+    if not units:
+        await send_text(context.bot, "📭 No hay borradores para programar.")
         return
 
-    await context.bot.send_message(SOURCE_CHAT_ID, "Usa: /desprogramar <id|all>")
+    pid = await create_schedule(DB_FILE, int(start.timestamp()), kind="drip",
+                                end_ts=int(end.timestamp()), curve=curve)
+    reserved = set(await reserve_drafts(DB_FILE, [mid for ids in units for mid in ids], pid))
+    total = sum(1 for ids in units if reserved.intersection(ids))
+    if not total:
+        await update_schedule(DB_FILE, pid, status="cancelled")
+        await send_text(context.bot, "📭 No hay borradores para programar.")
+        return
+    await update_schedule(DB_FILE, pid, total=total)
+    await _rearm(context.job_queue)
+
+    every = (end - start).total_seconds() / max(1, total - 1) / 60
+    await send_text(
+        context.bot,
+        f"💧 Goteo #{pid}: {total} envíos entre {start:%Y-%m-%d %H:%M} y {end:%Y-%m-%d %H:%M} ({TZNAME}), "
+        f"curva {curve} (≈ {every:.1f} min entre envíos de media). Empieza {human_eta(start, now)}."
+    )
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# "Plan de envío" de un borrador: lo mínimo que necesita el publicador, calculado UNA vez
+# al guardar el borrador. Así el bucle de publicación nunca vuelve a parsear el mensaje crudo.
+#   {"k": "copy"|"poll", "poll": kwargs de send_poll}
+# (el álbum y el snippet ya viven en sus propias columnas de `drafts`)
+import json
+from typing import Optional
+
+# ========= Encuestas =========
+def _poll_payload_from_raw(raw: dict):
+    p = raw.get("poll") or {}
+    question = p.get("question", "Pregunta")
+    options_src = p.get("options", []) or []
+    options  = [o.get("text", "") for o in options_src]
+
+    is_anon  = p.get("is_anonymous", True)
+    allows_multiple = p.get("allows_multiple_answers", False)
+    ptype = (p.get("type") or "regular").lower().strip()
+    is_quiz = (ptype == "quiz")
+
+    kwargs = dict(
+        question=question,
+        options=options,
+        is_anonymous=is_anon,
+    )
+
+    if not is_quiz:
+        kwargs["allows_multiple_answers"] = bool(allows_multiple)
+
+    if is_quiz:
+        kwargs["type"] = "quiz"
+        cid = p.get("correct_option_id")
+        try:
+            cid = int(cid) if cid is not None else None
+        except Exception:
+            cid = None
+        if cid is None or cid < 0 or cid >= len(options):
+            cid = 0
+        kwargs["correct_option_id"] = cid
+
+    if p.get("open_period") is not None and p.get("close_date") is None:
+        try:
+            kwargs["open_period"] = int(p["open_period"])
+        except Exception:
+            pass
+    elif p.get("close_date") is not None:
+        try:
+            kwargs["close_date"] = int(p["close_date"])
+        except Exception:
+            pass
+
+    if is_quiz and p.get("explanation"):
+        kwargs["explanation"] = str(p["explanation"])
+
+    return kwargs, is_quiz
+
+# ========= Plan =========
+def build_send_plan(raw: dict) -> dict:
+    """Plan compacto a partir de `Message.to_dict()`."""
+    plan = {"k": "copy"}
+    if raw.get("poll"):
+        plan["k"] = "poll"
+        plan["poll"], _ = _poll_payload_from_raw(raw)
+    return plan
+
+def encode_plan(plan: dict) -> str:
+    return json.dumps(plan, ensure_ascii=False, separators=(",", ":"))
+
+def decode_plan(value: Optional[str]) -> dict:
+    try:
+        return json.loads(value) if value else {"k": "copy"}
+    except Exception:
+        return {"k": "copy"}